@@ -1,15 +1,20 @@
 import os
-import io
 import json
+import tempfile
+import time
 import logging
-import requests
-import pandas as pd
+import threading
 from loguru import logger
 from datetime import datetime
-from google.cloud import storage
-from google.cloud import compute_v1
-from google.cloud import secretmanager
-from google.cloud import resourcemanager_v3
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait, as_completed
+from gcp_clients import storage_client, images_client, instances_client, disks_client, projects_client, folders_client
+from gcp_clients import log_stats as log_client_stats, snapshot_stats as snapshot_client_stats
+from project_snapshots import ProjectSnapshotStore, project_fingerprint, compliance_delta
+from run_checkpoint import RunCheckpoint
+from report_writer import open_report_writer, upload_report
+from secret_provider import get_secret_gcp, prefetch_secrets, log_stats as log_secret_stats, snapshot_stats as snapshot_secret_stats
 
 TENANT_ID = os.getenv('TENANT_ID')
 X_API_KEY_VALUE = os.getenv('X_API_KEY')
@@ -22,28 +27,97 @@ GRAPH_API_USERS_URL = os.getenv('GRAPH_API_USERS_URL')
 project_id = os.getenv('PROJECT_ID')
 organization_id = os.getenv('ORGANIZATION_ID', "531591688136")
 bucket_name = os.getenv('BUCKET_NAME') 
+bulk_disk_inventory = os.getenv('BULK_DISK_INVENTORY', 'true').lower() == 'true'
+discovery_workers = int(os.getenv('DISCOVERY_WORKERS', '8'))  # Folders listed concurrently
+scan_workers = int(os.getenv('SCAN_WORKERS', '16'))  # Projects scanned concurrently, 1 = serial
+image_cache_size = int(os.getenv('IMAGE_CACHE_SIZE', '4096'))
+cat_batch_size = int(os.getenv('CAT_BATCH_SIZE', '100'))  # Account IDs per CAT table batch_get
+report_format = os.getenv('REPORT_FORMAT', 'xlsx')  # xlsx, csv.gz or parquet
+incremental_scan = os.getenv('INCREMENTAL_SCAN', 'false').lower() == 'true'
+snapshot_prefix = os.getenv('SNAPSHOT_PREFIX', 'adoption-snapshots')
+checkpoint_prefix = os.getenv('CHECKPOINT_PREFIX', 'adoption-runs')
+graph_workers = int(os.getenv('GRAPH_WORKERS', '8'))  # Concurrent Graph API chunk requests
+email_cache_ttl_days = int(os.getenv('EMAIL_CACHE_TTL_DAYS', '7'))
+email_cache_path = os.getenv('EMAIL_CACHE_PATH')  # Local file cache; the GCS object below is used when unset
+email_cache_blob = os.getenv('EMAIL_CACHE_BLOB', 'cache/employee-email-cache.json')
+graph_token = {"access_token": None, "expires_at": 0}
+REPORT_COLUMNS = ["Project", "VM Name", "VM Creation Time", "VM Zone", "Source Image", "Image Creation Time", "Labels"
+, "Compliant Status", "Deprecation Status", "askid", "msid", "employeeid", "email"]
+DELTA_COLUMNS = ["Project", "VM Name", "VM Zone", "Previous Status", "Compliant Status", "Change"]
+graph_token_lock = threading.Lock()
 
-def list_projects_in_organization(org_id):
-    projects_client = resourcemanager_v3.ProjectsClient()
-    folders_client = resourcemanager_v3.FoldersClient()
-    folders = folders_client.search_folders(request={"query": f"parent=organizations/{org_id}"})
-    all_projects = []
-    for folder in folders:
-        all_projects.extend(fetch_projects_in_folder(folder.name, folders_client, projects_client))
-    logger.info(f"len projects: {len(all_projects)}")
-    return all_projects
-
-def fetch_projects_in_folder(folder_id, folders_client, projects_client):
+class ImageMetadataCache:
+    """Thread-safe LRU cache of image metadata keyed by (project, image), shared by one run."""
+
+    def __init__(self, image_client, max_size=image_cache_size):
+        self.image_client = image_client
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_project, image_name):
+        """Return (labels, deprecation_state, creation_timestamp), or None if the image is missing or forbidden."""
+        from google.api_core.exceptions import NotFound, Forbidden
+        key = (image_project, image_name)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        try:
+            image_info = self.image_client.get(project=image_project, image=image_name)
+            labels = dict(image_info.labels) if image_info.labels else {}
+            deprecation_state = image_info.deprecated.state if image_info.deprecated else None
+            entry = (labels, deprecation_state, image_info.creation_timestamp)
+        except (NotFound, Forbidden) as e:
+            logger.info(f"Image {image_project}/{image_name} unavailable, caching negative result: {e}")
+            entry = None
+        # Other errors propagate uncached so a transient failure is retried on the next disk
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        logger.info(f"Image cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {len(self.entries)} entries")
+
+def list_folder_children(parent, folders_client, projects_client):
+    """Return the active project IDs and the sub-folder names directly under one folder or organization."""
     projects = []
-    for project in projects_client.list_projects(parent=folder_id):
+    for project in projects_client.list_projects(parent=parent):
         if project.state.name == "ACTIVE":
             projects.append(project.project_id)
-    subfolders = folders_client.list_folders(parent=folder_id)
-    for subfolder in subfolders:
-        projects.extend(fetch_projects_in_folder(subfolder.name, folders_client, projects_client))
-    return projects
+    subfolders = [subfolder.name for subfolder in folders_client.list_folders(parent=parent)]
+    return projects, subfolders
+
+def iter_projects_in_organization(org_id, workers=discovery_workers):
+    """Walk the folder tree breadth-first with bounded concurrency, yielding project IDs as they are found."""
+    project_count = 0
+    folder_client, project_client = folders_client(), projects_client()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = {executor.submit(list_folder_children, f"organizations/{org_id}", folder_client, project_client)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                projects, subfolders = future.result()
+                for subfolder in subfolders:
+                    pending.add(executor.submit(list_folder_children, subfolder, folder_client, project_client))
+                project_count += len(projects)
+                yield from projects
+    logger.info(f"len projects: {project_count}")
+
+def list_projects_in_organization(org_id):
+    return list(iter_projects_in_organization(org_id))
 
-def call_api_with_batch_get(account_ids, x_api_key, cat_table_url):
+def call_api_with_batch_get(account_ids, x_api_key, cat_table_url, session=None):
+    import requests
     exceptions = []
     try:
         # logic to call the API with batch get
@@ -56,7 +130,7 @@ def call_api_with_batch_get(account_ids, x_api_key, cat_table_url):
             }
         }
         
-        response = requests.post(cat_table_url, headers=auth_headers, json=payload)
+        response = (session or requests).post(cat_table_url, headers=auth_headers, json=payload)
         payload = response.json()
         filtered_data = []
         for item in payload['queryResults']['Items']:
@@ -70,216 +144,437 @@ def call_api_with_batch_get(account_ids, x_api_key, cat_table_url):
         exceptions.append(e)
         return exceptions
 
-def get_secret_gcp(secret_id):
-    client = secretmanager.SecretManagerServiceClient()
-    name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
-    response = client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
+def get_graph_access_token(session):
+    """Return a Graph API access token, reusing the cached one until shortly before it expires."""
+    with graph_token_lock:
+        if graph_token["access_token"] and time.time() < graph_token["expires_at"]:
+            return graph_token["access_token"]
+        client_id = get_secret_gcp(CLIENT_ID)
+        responce_client_secret = get_secret_gcp(CLIENT_SECRET_NAME)
+        tenant_id = get_secret_gcp(TENANT_ID)
+        authority_url = AUTHORITY_URL.format(tenant_id)
+        request_data = {
+            'grant_type': 'client_credentials',
+            'client_id': client_id,
+            'client_secret': responce_client_secret,
+            'scope': GRAPH_API_SCOPE_URL
+        }
+        headers = {'Content-type': 'application/x-www-form-urlencoded'}
+        response = session.post(authority_url, headers=headers, data=request_data)
+        response.raise_for_status()
+        token = response.json()
+        graph_token["access_token"] = token['access_token']
+        # Refresh a minute early so a token never expires mid-request
+        graph_token["expires_at"] = time.time() + int(token.get('expires_in', 3600)) - 60
+        return graph_token["access_token"]
+
+def load_email_cache():
+    """Load the persisted employeeId -> {mail, fetched_at} cache from a local file or GCS object."""
+    try:
+        if email_cache_path:
+            if not os.path.exists(email_cache_path):
+                return {}
+            with open(email_cache_path) as cache_file:
+                return json.load(cache_file)
+        blob = storage_client().bucket(bucket_name).blob(email_cache_blob)
+        if not blob.exists():
+            return {}
+        return json.loads(blob.download_as_text())
+    except Exception as e:
+        logger.warning(f"Could not load employee email cache, starting empty: {e}")
+        return {}
+
+def save_email_cache(cache):
+    try:
+        content = json.dumps(cache)
+        if email_cache_path:
+            with open(email_cache_path, 'w') as cache_file:
+                cache_file.write(content)
+        else:
+            blob = storage_client().bucket(bucket_name).blob(email_cache_blob)
+            blob.upload_from_string(content, content_type='application/json')
+    except Exception as e:
+        logger.warning(f"Could not save employee email cache: {e}")
+
+def fetch_emails_for_chunk(empidschunk, session):
+    filter_string = ','.join(["'{}'".format(empId) for empId in empidschunk])
+    graph_api_url = f'{GRAPH_API_USERS_URL}?$filter=employeeId in ({filter_string})&$select=mail,employeeId'
+    headers = {
+        'Accept': 'application/json',
+        'Authorization': 'Bearer {}'.format(get_graph_access_token(session))
+    }
+    # Get email data
+    users_response = session.get(graph_api_url, headers=headers)
+    users_response.raise_for_status()
+    response_data_by_employeeid = {}
+    for user in users_response.json().get('value'):
+        employee_group = user.get('employeeId')
+        if employee_group not in response_data_by_employeeid:
+            response_data_by_employeeid[employee_group] = user.get('mail')
+    return response_data_by_employeeid
+
+def get_email_ids_from_employeeIds(employee_ids, cache=None):
+    """Resolve employee IDs to emails, serving fresh entries from the persistent cache and querying Graph for the rest.
+
+    With `cache`, resolved emails are added to it and the caller saves it; otherwise the cache is loaded and saved here.
+    """
+    filtered_response = {}
+    if not employee_ids:
+        return filtered_response
+    now = time.time()
+    owns_cache = cache is None
+    if owns_cache:
+        cache = load_email_cache()
+    missing = []
+    for empId in employee_ids:
+        entry = cache.get(str(empId))
+        if entry and now - entry['fetched_at'] < email_cache_ttl_days * 86400:
+            filtered_response[str(empId)] = entry['mail']
+        else:
+            missing.append(empId)
+    logger.info(f"Employee email cache: {len(filtered_response)} cached, {len(missing)} to resolve")
+
+    import requests
+    employeeid_chunks = [missing[x:x+15] for x in range(0, len(missing), 15)]
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=graph_workers) as executor:
+        futures = {executor.submit(fetch_emails_for_chunk, chunk, session): chunk for chunk in employeeid_chunks}
+        for future, empidschunk in futures.items():
+            try:
+                resolved = future.result()
+            except Exception as e:
+                logging.error("Error while getting email ids from graph api: %s", e)
+                continue
+            for empId in empidschunk:
+                # IDs Graph does not know are cached as None too, so they are not re-queried until the TTL lapses
+                mail = resolved.get(str(empId))
+                filtered_response[str(empId)] = mail
+                cache[str(empId)] = {'mail': mail, 'fetched_at': now}
+    if missing and owns_cache:
+        save_email_cache(cache)
+    return filtered_response
+
+def build_disk_index(disk_client, org_project_id):
+    """Map every disk self-link in the project to its source image using one aggregated listing."""
+    from google.cloud import compute_v1
+    disk_index = {}
+    request = compute_v1.AggregatedListDisksRequest(project=org_project_id, max_results=500)
+    for zone, disks_scoped_list in disk_client.aggregated_list(request=request):
+        for disk in disks_scoped_list.disks:
+            disk_index[disk.self_link] = disk.source_image
+    logger.info(f"Indexed {len(disk_index)} disks for project {org_project_id}")
+    return disk_index
+
+def resolve_source_image(disk_client, disk_index, org_project_id, disk_source):
+    if disk_source in disk_index:
+        return disk_index[disk_source]
+    # Disk created after the inventory was taken (or bulk mode disabled), fall back to a direct get
+    disk_name = disk_source.split("/")[-1]
+    disk_zone = disk_source.split("/zones/")[1].split("/")[0]
+    disk_info = disk_client.get(project=org_project_id, zone=disk_zone, disk=disk_name)
+    return disk_info.source_image
+
+def list_project_instances(instance_client, org_project_id):
+    """Return (zone, instance) pairs for every VM in the project from one paged aggregated listing."""
+    from google.cloud import compute_v1
+    request = compute_v1.AggregatedListInstancesRequest(project=org_project_id, max_results=300)
+    instances = []
+    for zone, instances_scoped_list in instance_client.aggregated_list(request=request):
+        for instance in instances_scoped_list.instances:
+            instances.append((zone, instance))
+    return instances
+
+def image_columns(image_metadata):
+    """Report columns derived from the source image: labels, compliance, deprecation state and creation time."""
+    if image_metadata:
+        labels, deprecation_status, image_creation_time = image_metadata
+    else:
+        labels = {}
+        deprecation_status = None
+        image_creation_time = None
+
+    # Determine compliance status
+    compliant_status = "NON_COMPLIANT"
+    if labels and 'image_type' in labels:
+        if labels['image_type'] == 'golden-image':
+            compliant_status = "COMPLIANT"
+    return {
+        "Image Creation Time": image_creation_time,
+        "Labels": json.dumps(labels),
+        "Compliant Status": compliant_status,
+        "Deprecation Status": deprecation_status,
+    }
 
-def get_email_ids_from_employeeIds(employee_ids):
-        exceptions = []
+def refresh_image_columns(rows, image_cache):
+    """Recompute the image-derived columns of stored rows, since images are relabeled and deprecated on their own schedule.
+
+    Returns None when a row predates the "Image Project" field and so cannot be refreshed. A row whose image
+    lookup fails keeps its stored columns.
+    """
+    refreshed = []
+    for row in rows:
+        if "Image Project" not in row:
+            return None
         try:
-            client_id = get_secret_gcp(CLIENT_ID)
-            responce_client_secret = get_secret_gcp(CLIENT_SECRET_NAME)
-            tenant_id = get_secret_gcp(TENANT_ID)
-            authority_url = AUTHORITY_URL.format(tenant_id)
-            request_data = {
-                'grant_type': 'client_credentials',
-                'client_id': client_id,
-                'client_secret': responce_client_secret,
-                'scope': GRAPH_API_SCOPE_URL
-            }
-            headers = {'Content-type': 'application/x-www-form-urlencoded'}
-            # Get access token
-            response = requests.post(authority_url, headers=headers, data=request_data)
-            filtered_response = {}
-                    
-            if employee_ids and len(employee_ids) > 0 and response.status_code == 200:
-                employeeid_chunks = [employee_ids[x:x+15] for x in range(0, len(employee_ids), 15)]
-                for empidschunk in employeeid_chunks:
-                    filter_string = ','.join(["'{}'".format(empId) for empId in empidschunk])
-                    graph_api_url = f'{GRAPH_API_USERS_URL}?$filter=employeeId in ({filter_string})&$select=mail,employeeId'
-                    headers = {
-                        'Accept': 'application/json',
-                        'Authorization': 'Bearer {}'.format(response.json()['access_token'])
-                    }
-                    # Get email data
-                    users_response = requests.get(graph_api_url, headers=headers)
-                    if users_response.status_code == 200:
-                        users = users_response.json().get('value')
-                        response_data_by_employeeid = {}
-                        for user in users:
-                            employee_group = user.get('employeeId')
-                            if employee_group not in response_data_by_employeeid:
-                                response_data_by_employeeid[employee_group] = user.get('mail')
-                        filtered_response.update(response_data_by_employeeid)
-                    else:
-                        exceptions.append(response.text)
-                        return exceptions
-            return filtered_response
- 
+            image_metadata = image_cache.get(row["Image Project"], row["Source Image"])
         except Exception as e:
-            logging.error("Error while getting email ids from graph api: %s",e)
-            exceptions.append(e)
-            return exceptions
-
-def fetch_instance_data(org_project_id):   
-    instance_client = compute_v1.InstancesClient()
-    disk_client = compute_v1.DisksClient()
-    image_client = compute_v1.ImagesClient()
+            logger.info(f"Error fetching image info for {row['Source Image']}, keeping stored columns: {e}")
+            refreshed.append(row)
+            continue
+        refreshed.append({**row, **image_columns(image_metadata)})
+    return refreshed
+
+def fetch_instance_data(org_project_id, image_cache=None, instances=None):   
+    instance_client = instances_client()
+    disk_client = disks_client()
+    if image_cache is None:
+        image_cache = ImageMetadataCache(images_client())
     results = []
-    account_ids = []
+    if instances is None:
+        instances = list_project_instances(instance_client, org_project_id)
+    if not instances:
+        return results
+    disk_index = build_disk_index(disk_client, org_project_id) if bulk_disk_inventory else {}
 
-    request = compute_v1.AggregatedListInstancesRequest(project=org_project_id, max_results=300)
-    while True:
-        all_instances = instance_client.aggregated_list(request=request) 
-        for zone, instances_scoped_list in all_instances:
-            if instances_scoped_list.instances:
-                for instance in instances_scoped_list.instances:
-                    instance_name = instance.name
-                    vm_creation_time = instance.creation_timestamp  # VM creation timestamp
-                    vm_zone = zone.split('/')[-1]  # Extract zone from the zone path
-                    
-                    # Iterate through attached disks
-                    for disk in instance.disks:
-                        disk_source = disk.source
-                        
-                        if not disk_source:
-                            continue
-                        
-                        # Extract disk name and zone
-                        disk_name = disk_source.split("/")[-1]
-                        disk_zone = disk_source.split("/all_instances/")[1].split("/")[0]
-                        
-                        # Fetch the source image URL from the disk
-                        try:
-                            disk_info = disk_client.get(project=org_project_id, zone=disk_zone, disk=disk_name)
-                            source_image_url = disk_info.source_image
-                        except Exception as e:
-                            logger.info(f"Error fetching disk info for {disk_name}: {e}")
-                            continue
-                        
-                        if source_image_url:
-                            # Extract image name and project from the source image URL
-                            image_name = source_image_url.split("/")[-1]
-                            image_project = source_image_url.split("/")[-4]
-                            
-                            # Fetch image labels and creation timestamp
-                            try:
-                                image_info = image_client.get(project=image_project, image=image_name)
-                                labels = dict(image_info.labels) if image_info.labels else {}
-                                deprecation_status = image_info.deprecated
-                                image_creation_time = image_info.creation_timestamp  # Image creation timestamp
-                            except Exception as e:
-                                logger.info(f"Error fetching image info for {image_name}: {e}")
-                                labels = {}
-                                deprecation_status = None
-                                image_creation_time = None
-                            
-                            # Determine compliance status
-                            compliant_status = "NON_COMPLIANT"
-                            if labels and 'image_type' in labels:
-                                if labels['image_type'] == 'golden-image':
-                                    compliant_status = "COMPLIANT"
-                            if deprecation_status: 
-                                deprecation_status = deprecation_status.state
-                            
-                            account_ids.append(org_project_id)
-                            # Store the result
-                            results.append({
-                                "Project": org_project_id,
-                                "VM Name": instance_name,
-                                "VM Creation Time": vm_creation_time,
-                                "VM Zone": vm_zone,
-                                "Source Image": image_name,
-                                "Image Creation Time": image_creation_time,
-                                "Labels": json.dumps(labels),
-                                "Compliant Status": compliant_status,
-                                "Deprecation Status": deprecation_status,
-                            })
-                        else:
-                            logger.info(f"No source image found for disk {disk_name} in project {org_project_id}")
-    
-        if all_instances.next_page_token:
-            request.page_token = all_instances.next_page_token
-        else:
-            break
+    for zone, instance in instances:
+        instance_name = instance.name
+        vm_creation_time = instance.creation_timestamp  # VM creation timestamp
+        vm_zone = zone.split('/')[-1]  # Extract zone from the zone path
+        
+        # Iterate through attached disks
+        for disk in instance.disks:
+            disk_source = disk.source
+            
+            if not disk_source:
+                continue
+            
+            disk_name = disk_source.split("/")[-1]
+            
+            # Resolve the source image URL from the disk inventory
+            try:
+                source_image_url = resolve_source_image(disk_client, disk_index, org_project_id, disk_source)
+            except Exception as e:
+                logger.info(f"Error fetching disk info for {disk_name}: {e}")
+                continue
+            
+            if source_image_url:
+                # Extract image name and project from the source image URL
+                image_name = source_image_url.split("/")[-1]
+                image_project = source_image_url.split("/")[-4]
+                
+                # Fetch image labels and creation timestamp
+                try:
+                    image_metadata = image_cache.get(image_project, image_name)
+                except Exception as e:
+                    logger.info(f"Error fetching image info for {image_name}: {e}")
+                    image_metadata = None
+                
+                # Store the result
+                results.append({
+                    "Project": org_project_id,
+                    "VM Name": instance_name,
+                    "VM Creation Time": vm_creation_time,
+                    "VM Zone": vm_zone,
+                    "Source Image": image_name,
+                    # Not a report column; kept so stored rows can be refreshed from the image later
+                    "Image Project": image_project,
+                    **image_columns(image_metadata),
+                })
+            else:
+                logger.info(f"No source image found for disk {disk_name} in project {org_project_id}")
+
+    return results
 
-    unique_account_ids = (list(set(account_ids)))
+def enrich_with_ownership(results, batch_size=cat_batch_size, session=None, email_cache=None):
+    """Join CAT table ownership and owner emails onto a batch of scanned rows in one pass."""
+    unique_account_ids = sorted({obj["Project"] for obj in results})
     X_API_KEY = get_secret_gcp(X_API_KEY_VALUE)
-    result_json_array = call_api_with_batch_get(unique_account_ids,X_API_KEY,CAT_TABLE_URL)
-    
-    # Populate the dictionary with data from the second array which has askid and msid attached
+
+    # Populate the dictionary with data from the CAT table which has askid and msid attached
     employee_ids = []
     subscription_mapping = {}
-    for obj in result_json_array:
-        if obj["employeeid"]:
-            employee_ids.append(obj.get("employeeid"))
-            subscription_mapping[obj["subscription_id"]] = {"askid": obj["askid"], "msid": obj["msid"], "employeeid": obj["employeeid"]}
-    # Iterate through the original array without ask ID & msid and map the respective ask ID and msid to account_id
-    for obj in results:
-        subscription_id = obj["Project"]
-        if subscription_id in subscription_mapping:
-            obj["askid"] = subscription_mapping[subscription_id]["askid"]
-            obj["msid"] = subscription_mapping[subscription_id]["msid"]
-            obj["employeeid"] = str(subscription_mapping[subscription_id]["employeeid"])
-    data = results
+    for i in range(0, len(unique_account_ids), batch_size):
+        batch = unique_account_ids[i:i + batch_size]
+        result_json_array = call_api_with_batch_get(batch, X_API_KEY, CAT_TABLE_URL, session)
+        for obj in result_json_array:
+            if isinstance(obj, dict) and obj["employeeid"]:
+                employee_ids.append(obj.get("employeeid"))
+                subscription_mapping[obj["subscription_id"]] = {"askid": obj["askid"], "msid": obj["msid"], "employeeid": obj["employeeid"]}
+    logger.info(f"Resolved ownership for {len(subscription_mapping)} of {len(unique_account_ids)} projects")
+
+    user_email_response = {}
     try:
         # Get unique employee ids
         unique_employee_ids = (list(set(employee_ids)))
-        user_email_response = get_email_ids_from_employeeIds(unique_employee_ids)
-        results = [{**obj, **{'email': user_email_response.get(obj.get('employeeid'))}} for obj in data]
-        logging.info('Result with email: %s', len(results))
+        user_email_response = get_email_ids_from_employeeIds(unique_employee_ids, email_cache)
     except Exception as e:
         logging.error('Error in getting User Email \'%s\':', e)
-    return results
 
-def upload_to_gcs(bucket_name, destination_blob_name, buffer):
+    # Map the respective ask ID, msid and email to each row by project
+    enriched = []
+    for obj in results:
+        owner = subscription_mapping.get(obj["Project"])
+        if owner:
+            obj = {**obj, "askid": owner["askid"], "msid": owner["msid"], "employeeid": str(owner["employeeid"])}
+        if isinstance(user_email_response, dict):
+            obj = {**obj, 'email': user_email_response.get(obj.get('employeeid'))}
+        enriched.append(obj)
+    logging.info('Result with email: %s', len(enriched))
+    return enriched
+
+def scan_project(org_project_id, image_cache=None, snapshots=None, checkpoint=None):
+    """Scan one project, returning (project, rows, delta_rows, error).
+
+    With a snapshot store, a project whose fingerprint matches the previous run reuses its stored rows.
+    With a checkpoint, the outcome is recorded durably and rows and delta come back as None: the report
+    is assembled from the checkpoints, so the scan does not keep them in memory.
+    """
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_file(buffer, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        logger.info(f"File uploaded to gs://{bucket_name}/{destination_blob_name}")
+        logger.info(f"Processing Project: {org_project_id}")
+        rows, delta = scan_project_rows(org_project_id, image_cache, snapshots)
+        if checkpoint:
+            checkpoint.complete(org_project_id, rows, delta)
+            return org_project_id, None, None, None
+        return org_project_id, rows, delta, None
     except Exception as e:
-        logger.info(f"Error uploading file to GCS: {e}")
+        # Log the error and continue to the next project
+        logger.error(f"Error processing project {org_project_id}: {e}")
+        if checkpoint:
+            checkpoint.fail(org_project_id)
+        return org_project_id, None, [], e
+
+def scan_project_rows(org_project_id, image_cache=None, snapshots=None):
+    if snapshots is None:
+        return fetch_instance_data(org_project_id, image_cache), []
+    if image_cache is None:
+        image_cache = ImageMetadataCache(images_client())
+    instances = list_project_instances(instances_client(), org_project_id)
+    fingerprint = project_fingerprint(instances)
+    previous_rows = snapshots.read_rows(org_project_id)
+    rows = None
+    if previous_rows is not None and snapshots.is_unchanged(org_project_id, fingerprint):
+        # The VMs are unchanged, but their images may have been relabeled, deprecated or obsoleted since
+        rows = refresh_image_columns(previous_rows, image_cache)
+        if rows == previous_rows:
+            logger.info(f"Project {org_project_id} unchanged since last run, reusing stored rows")
+            return previous_rows, []
+        if rows is not None:
+            logger.info(f"Project {org_project_id} VMs unchanged, refreshed image columns of stored rows")
+    if rows is None:
+        rows = fetch_instance_data(org_project_id, image_cache, instances)
+    delta = []
+    if snapshots.has_baseline:
+        delta = compliance_delta(previous_rows, rows)
+    snapshots.write_rows(org_project_id, rows, fingerprint)
+    return rows, delta
+
+def iter_scan_results(projects, image_cache=None, snapshots=None, checkpoint=None, workers=scan_workers):
+    """Scan projects with at most `workers` in flight, yielding scan_project results as they finish.
+
+    `projects` may be a generator; it is only advanced when a slot frees up, so a slow project never
+    holds back the results of the ones submitted after it.
+    """
+    workers = max(1, workers)
+    scan = partial(scan_project, image_cache=image_cache, snapshots=snapshots, checkpoint=checkpoint)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for project in projects:
+            if len(pending) >= workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(scan, project))
+        for future in as_completed(pending):
+            yield future.result()
+
+def write_enriched_rows(writer, rows, session, email_cache=None):
+    try:
+        rows = enrich_with_ownership(rows, session=session, email_cache=email_cache)
+    except Exception as e:
+        logger.error(f"Error enriching rows with ownership, writing them without it: {e}")
+    writer.write_rows(rows)
 
 def main(request=None):
+    # Counters outlive a warm instance's invocations, so this run's figures are taken relative to these
+    client_stats, secret_stats = snapshot_client_stats(), snapshot_secret_stats()
     try:
-        projects = list_projects_in_organization(organization_id)
-        success_list, failure_list = [], []
-        all_results = []
+        prefetch_secrets([X_API_KEY_VALUE, CLIENT_ID, CLIENT_SECRET_NAME, TENANT_ID])
+        checkpoint = RunCheckpoint(bucket_name, checkpoint_prefix)
+        snapshots = ProjectSnapshotStore(bucket_name, snapshot_prefix) if incremental_scan else None
+        # Projects stream into the scan pool while the folder walk is still running
+        projects = checkpoint.remaining(iter_projects_in_organization(organization_id))
+        logger.info(f"Scanning projects with {scan_workers} workers")
+        image_cache = ImageMetadataCache(images_client())
 
-        for org_project_id in projects:
-            try:
-                logger.info(f"Processing Project: {org_project_id}")
-                project_data = fetch_instance_data(org_project_id)
-                all_results.extend(project_data)
-                success_list.append(org_project_id)
-            except Exception as e:
-                failure_list.append(org_project_id)
-                # Log the error and continue to the next project
-                logger.error(f"Error processing project {org_project_id}: {e}")
-                continue
+        # Each project is checkpointed as soon as it finishes, so a restarted run only redoes unfinished work
+        for _ in iter_scan_results(projects, image_cache, snapshots, checkpoint):
+            if checkpoint.maybe_flush() and snapshots:
+                snapshots.save()
+        checkpoint.flush()
+        if snapshots:
+            snapshots.save()
+        image_cache.log_stats()
+        log_secret_stats(secret_stats)
+        log_client_stats(client_stats)
+        success_list, failure_list = sorted(checkpoint.completed), sorted(checkpoint.failed)
         logger.info(f"Success Project List: {success_list}")
         logger.info(f"Failure Project List: {failure_list}")
         logger.info(f"Success Project Count: {len(success_list)}")
         logger.info(f"Failure Project Count: {len(failure_list)}")
 
-        # Convert results to a DataFrame and save to Excel
-        if all_results:
-            df = pd.DataFrame(all_results)
-            buffer = io.BytesIO()
-            df.to_excel(buffer, index=False)
-            buffer.seek(0)
-
-            cur_date = datetime.now().strftime("%Y-%m-%d")
-            upload_to_gcs(bucket_name, f"adoption-report-{cur_date}.xlsx", buffer)
-            logger.info("File uploaded successfully!")
-            return {"message": "File uploaded successfully!"}, 200
-        else:
-            logger.warning("No results to process. Exiting.")
-            return {"message": "No data processed"}, 204
+        # The report is assembled from the checkpoints, enriched and written every CAT_BATCH_SIZE projects
+        report_file = tempfile.NamedTemporaryFile(suffix=f".{report_format}", delete=False)
+        report_file.close()
+        writer = open_report_writer(report_format, report_file.name, REPORT_COLUMNS)
+        delta_file, delta_writer = None, None
+        if snapshots:
+            delta_file = tempfile.NamedTemporaryFile(suffix=f".delta.{report_format}", delete=False)
+            delta_file.close()
+            delta_writer = open_report_writer(report_format, delta_file.name, DELTA_COLUMNS)
+        try:
+            pending_rows, pending_projects = [], 0
+            # Loaded once and saved once per run rather than once per CAT_BATCH_SIZE batch
+            email_cache = load_email_cache()
+            loaded_email_cache = dict(email_cache)
+            import requests
+            with requests.Session() as session:
+                for org_project_id, project_data, delta in checkpoint.iter_results():
+                    if delta_writer:
+                        delta_writer.write_rows(delta)
+                    pending_rows.extend(project_data)
+                    pending_projects += 1
+                    if pending_projects >= cat_batch_size:
+                        write_enriched_rows(writer, pending_rows, session, email_cache)
+                        pending_rows, pending_projects = [], 0
+                if pending_rows:
+                    write_enriched_rows(writer, pending_rows, session, email_cache)
+            if email_cache != loaded_email_cache:
+                save_email_cache(email_cache)
+            writer.close()
+            if delta_writer:
+                delta_writer.close()
+
+            if writer.row_count:
+                cur_date = datetime.now().strftime("%Y-%m-%d")
+                try:
+                    upload_report(bucket_name, f"adoption-report-{cur_date}.{writer.extension}", report_file.name, writer.content_type)
+                    if delta_writer:
+                        logger.info(f"Compliance changes since last run: {delta_writer.row_count}")
+                        upload_report(bucket_name, f"adoption-delta-{cur_date}.{delta_writer.extension}", delta_file.name, delta_writer.content_type)
+                    checkpoint.finish()
+                except Exception as e:
+                    # The run stays unfinished, so a retry within CHECKPOINT_MAX_AGE_HOURS reuses its checkpoints
+                    logger.error(f"Error uploading file to GCS: {e}")
+                    return {"error": f"Error uploading report: {e}"}, 500
+                logger.info("File uploaded successfully!")
+                return {"message": "File uploaded successfully!"}, 200
+            else:
+                checkpoint.finish()
+                logger.warning("No results to process. Exiting.")
+                return {"message": "No data processed"}, 204
+        finally:
+            os.remove(report_file.name)
+            if delta_file:
+                os.remove(delta_file.name)
 
     except Exception as e:
         logger.error(f"Error in main function: {e}")
@@ -1,10 +1,13 @@
 import os
 import json
+import time
 import logging
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from google.cloud import storage
-from google.cloud.devtools.cloudbuild_v1 import CloudBuildClient
+from gcp_clients import storage_client, cloud_build_client
+from build_cache import BuildKeyCache, build_key, resolve_source_image_id
+from build_scheduler import BuildScheduler, CloudBuildBackend, GcsStateStore, SchedulerBusy
 
 # Initialize logging
 logger = logging.getLogger()
@@ -27,14 +30,27 @@ service_account_id = os.getenv('service_account_id', 'service-account-id')
 namespace   = os.getenv('namespace','namespace') 
 kms_key = os.getenv('kms_key')
 TOPIC_NAME = os.getenv('TOPIC_NAME')
+build_submit_workers = int(os.getenv('BUILD_SUBMIT_WORKERS', '8'))  # create_build calls in flight at once
+# Wait for the builds and report their outcome. Builds run for far longer than the function's default
+# 60s timeout, so only enable this with FUNCTION_TIMEOUT_SECONDS set to the deployed function timeout.
+watch_builds = os.getenv('WATCH_BUILDS', 'false').lower() == 'true'
+build_poll_seconds = int(os.getenv('BUILD_POLL_SECONDS', '30'))
+function_timeout = int(os.getenv('FUNCTION_TIMEOUT_SECONDS', '60'))
+# Leave room to submit the builds before watching and to return the result after
+build_watch_timeout = int(os.getenv('BUILD_WATCH_TIMEOUT_SECONDS', str(max(0, function_timeout - 120))))
 
+use_build_cache = os.getenv('BUILD_CACHE', 'true').lower() == 'true'  # Skip images whose build inputs are unchanged
+force_rebuild = os.getenv('FORCE_REBUILD', 'false').lower() == 'true'
+# Queue builds by priority under BUILD_MAX_IN_FLIGHT instead of submitting them all; a scheduled
+# {"action": "tick"} request then admits queued builds as running ones finish
+use_build_scheduler = os.getenv('BUILD_SCHEDULER', 'false').lower() == 'true'
+scheduler_bucket = os.getenv('SCHEDULER_BUCKET') or supported_images_bucket
+scheduler_object = os.getenv('SCHEDULER_OBJECT', 'build-scheduler/queue.json')
 
-# Initialize Google Cloud clients
-storage_client = storage.Client()
-cloud_build_client = CloudBuildClient()
+TERMINAL_BUILD_STATUSES = {"SUCCESS", "FAILURE", "INTERNAL_ERROR", "TIMEOUT", "CANCELLED", "EXPIRED"}
 
 
-def trigger_cloud_build(client, image_name, image):
+def trigger_cloud_build(client, image_name, image, run_tag=None):
     """Trigger a Cloud Build for a given image."""
     try:
         logger.info(f"Network VPC {network_id}")
@@ -93,6 +109,9 @@ def trigger_cloud_build(client, image_name, image):
             'service_account': service_account_id,
             'options': {'logging': 'CLOUD_LOGGING_ONLY'},            
         }
+        if run_tag:
+            # Lets the watcher find every build of this run with a single filtered list_builds
+            build_config['tags'] = [run_tag]
 
         logger.info(f"Start Test Build {image.get('image_family')}")
 
@@ -107,11 +126,89 @@ def trigger_cloud_build(client, image_name, image):
         logger.error("".join(traceback.format_exc()))  # Log full traceback
         raise
 
-def handle():
-    """Process the supported_images.json file and trigger builds."""
+def seconds_between(start, end):
+    if not start or not end:
+        return None
+    return round((end - start).total_seconds(), 1)
+
+
+def build_result(build):
+    return {
+        "build_id": build.id,
+        "status": build.status.name,
+        "queue_seconds": seconds_between(build.create_time, build.start_time),
+        "duration_seconds": seconds_between(build.start_time, build.finish_time),
+        "log_url": build.log_url,
+    }
+
+
+def watch_cloud_builds(client, run_tag, builds, poll_seconds=build_poll_seconds, timeout=build_watch_timeout):
+    """Poll every build of a run with one filtered list_builds call per interval until all are finished.
+
+    `builds` maps build id to image name. Returns {image_name: result}; builds still running at the
+    timeout are reported with their last known status.
+    """
+    results = {}
+    deadline = time.monotonic() + timeout
+    while True:
+        for build in client.list_builds(project_id=project_id, filter=f'tags="{run_tag}"'):
+            if build.id in builds:
+                results[builds[build.id]] = build_result(build)
+        running = [name for name, result in results.items() if result["status"] not in TERMINAL_BUILD_STATUSES]
+        running += [name for name in builds.values() if name not in results]
+        if not running:
+            break
+        if time.monotonic() + poll_seconds > deadline:
+            logger.warning(f"Stopped watching with {len(running)} builds still running: {running}")
+            break
+        logger.info(f"Waiting for {len(running)} builds: {running}")
+        time.sleep(poll_seconds)
+    return results
+
+
+def is_forced(force, name):
+    """`force` is True for every image or a list of image names to rebuild regardless of the build cache."""
+    return force is True or (isinstance(force, list) and name in force)
+
+
+def open_build_cache():
+    """The build key cache, or None when it is disabled or cannot be opened; without it every image is built."""
+    if not use_build_cache:
+        return None
+    try:
+        return BuildKeyCache()
+    except Exception as e:
+        logger.warning(f"Build cache unavailable, building every image: {e}")
+        return None
+
+
+def build_scheduler(cache=None):
+    """Scheduler over Cloud Build; finished builds record their final status in the build cache."""
+    def submit_build(name, image):
+        return trigger_cloud_build(cloud_build_client(), name, image, "scheduled").metadata.build.id
+
+    def on_finished(name, entry):
+        if cache and entry.get("build_key") and entry.get("build_id"):
+            cache.put(name, entry["build_key"], entry["build_id"], entry["status"])
+
+    backend = CloudBuildBackend(cloud_build_client(), project_id, submit_build)
+    return BuildScheduler(backend, GcsStateStore(scheduler_bucket, scheduler_object), on_finished=on_finished)
+
+
+def handle_tick():
+    """Advance the build queue: refresh running builds and admit queued ones into free slots."""
+    try:
+        return {"statusCode": 200, "queue": build_scheduler(open_build_cache()).tick()}
+    except SchedulerBusy as e:
+        logger.info(f"Build queue busy, skipping this tick: {e}")
+        return {"statusCode": 200, "message": "Build queue is being updated by another invocation"}
+
+
+def handle(force=False):
+    """Process the supported_images.json file, trigger builds concurrently and watch them to completion."""
     try:
         # Read the supported_images.json file from GCS
-        bucket = storage_client.bucket(supported_images_bucket)
+        bucket = storage_client().bucket(supported_images_bucket)
         object = bucket.blob('supported_images.json')
         logger.info("Downloading supported_images.json...")
         file_content = object.download_as_text()
@@ -124,13 +221,96 @@ def handle():
             logger.error("No GCP images found in the JSON file.")
             return {"statusCode": 400, "error": "No GCP images found in the provided JSON."}
 
-        # Trigger Cloud Build for each image
-        for name, image in image_list.items():
-            logger.info(f"Triggering build for image: {name}")
-            
-            trigger_cloud_build(cloud_build_client, name, image)
+        run_tag = f"trigger-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}"
+        cache = open_build_cache()
+        bundle_generation = None
+        if cache:
+            try:
+                bundle = storage_client().bucket(codebuild_bucket).get_blob('codebuild.zip')
+                bundle_generation = bundle.generation if bundle else None
+            except Exception as e:
+                # The bundle generation is part of every key, so without it the cache cannot be used
+                logger.warning(f"Could not read the codebuild.zip generation, building every image: {e}")
+                cache = None
+        keys = {}
+
+        def submit(item):
+            name, image = item
+            try:
+                if cache:
+                    try:
+                        keys[name] = build_key(resolve_source_image_id(image), image, bundle_generation)
+                    except Exception as e:
+                        # Without a key the image is simply built, as it was before the cache existed
+                        logger.warning(f"Could not compute build key for {name}, building it: {e}")
+                if name in keys and not is_forced(force, name):
+                    try:
+                        current = cache.is_current(name, keys[name], cloud_build_client(), project_id)
+                    except Exception as e:
+                        # A cache outage must not block builds; treat the image as changed
+                        logger.warning(f"Build cache check failed for {name}, building it: {e}")
+                        current = False
+                    if current:
+                        logger.info(f"Skipping build for image {name}: source, config and bundle are unchanged")
+                        return name, None, "SKIPPED"
+                if use_build_scheduler:
+                    return name, None, "SCHEDULED"
+                logger.info(f"Triggering build for image: {name}")
+                operation = trigger_cloud_build(cloud_build_client(), name, image, run_tag)
+                build_id = operation.metadata.build.id
+                if name in keys:
+                    try:
+                        cache.put(name, keys[name], build_id, "QUEUED")
+                    except Exception as e:
+                        # The build is already submitted; the next run just rebuilds instead of skipping
+                        logger.warning(f"Could not record build key for {name}: {e}")
+                return name, build_id, None
+            except Exception as e:
+                return name, None, str(e)
+
+        # Trigger Cloud Build for every image at once
+        results = {}
+        builds = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(build_submit_workers, len(image_list)))) as executor:
+            for name, build_id, error in executor.map(submit, image_list.items()):
+                if error in ("SKIPPED", "SCHEDULED"):
+                    results[name] = {"build_id": None, "status": error}
+                elif error:
+                    results[name] = {"build_id": None, "status": "SUBMIT_FAILED", "error": error}
+                else:
+                    builds[build_id] = name
+                    results[name] = {"build_id": build_id, "status": "QUEUED"}
+
+        if use_build_scheduler:
+            scheduler = build_scheduler(cache)
+            try:
+                # enqueue retries while a tick holds the queue, so an overlapping tick only delays it
+                scheduler.enqueue([(name, image_list[name], image_list[name].get("priority"), {"build_key": keys.get(name)})
+                                   for name, result in results.items() if result["status"] == "SCHEDULED"])
+            except SchedulerBusy as e:
+                not_queued = sorted(name for name, result in results.items() if result["status"] == "SCHEDULED")
+                logger.error(f"Build queue stayed busy, {len(not_queued)} images were not queued: {e}")
+                return {"statusCode": 503, "error": "Build queue is busy, retry the trigger", "not_queued": not_queued}
+            try:
+                queue = scheduler.tick()
+            except SchedulerBusy as e:
+                # The images are queued; the next scheduled tick admits them
+                logger.info(f"Build queue busy after enqueue, leaving admission to the next tick: {e}")
+                queue = None
+            return {"statusCode": 200, "message": "Builds queued", "builds": results, "queue": queue}
+
+        if watch_builds and builds:
+            results.update(watch_cloud_builds(cloud_build_client(), run_tag, builds))
+            if cache:
+                for name, result in results.items():
+                    if name in keys and result["build_id"] and result["status"] in TERMINAL_BUILD_STATUSES:
+                        cache.put(name, keys[name], result["build_id"], result["status"])
 
-        return {"statusCode": 200, "message": "Builds triggered successfully"}
+        failed = [name for name, result in results.items()
+                  if result["status"] not in ("SUCCESS", "SKIPPED", "QUEUED", "WORKING", "PENDING")]
+        status_code = 500 if failed else 200
+        message = f"{len(builds)} builds triggered, {len(failed)} failed" if failed else "Builds triggered successfully"
+        return {"statusCode": status_code, "message": message, "builds": results}
 
     except Exception as e:
         logger.error(f"Error while processing request: {str(e)}")
@@ -142,7 +322,11 @@ def main(request=None):
     """HTTP Cloud Function to handle requests."""
     try:
         logger.info("Starting the main function...")
-        response = handle()
+        body = (request.get_json(silent=True) if request else None) or {}
+        if body.get("action") == "tick":
+            response = handle_tick()
+        else:
+            response = handle(force=body.get("force", force_rebuild))
         logger.info(f"Function executed successfully. Response: {response}")
         return (
             json.dumps(response),
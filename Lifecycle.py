@@ -1,106 +1,54 @@
 import os
 import json
-import boto3
-import pytz
 from loguru import logger
-from google.cloud import compute_v1
-from google.cloud import secretmanager
-from datetime import datetime, timezone, timedelta
+from gcp_clients import images_client, log_stats as log_client_stats
+from metadata_writer import MetadataWriter, get_dynamodb_client
+from lifecycle_engine import lifecycle_policy, run_lifecycle, summarize
 
 
 project_id = os.getenv('PROJECT_ID', "zjmqcnnb-gf42-i38m-a28a-y3gmil")  # Google Cloud Project ID
 image_family = os.getenv('GIM_FAMILY', "gim-rhel-9")  # Google Cloud image family
 image_table =  os.getenv('dynamodb_table', "smadu4-golden-images-metadata")
 
-case_no = 3
+case_no = int(os.getenv('LIFECYCLE_CASE', '3'))  # 0 runs every transition in one pass, 1-3 run a single transition
 delete_interval = 3
 deprecate_interval = 1
 obsoleted_interval = 2
 
-def get_secret_gcp(secret_id):
-    client = secretmanager.SecretManagerServiceClient()
-    name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
-    response = client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
+def lifecycle_status(outcomes):
+    summary = summarize(outcomes)
+    if summary["failed"]:
+        return False, summary["errors"]
+    return True, None
 
-def update_dynamodb_inactive(db_client, image_name):
-    try:
-        key = { 'csp': {'S': 'gcp'}, 'image_name': {'S': image_name} }
-        db_client.update_item(TableName=image_table, Key=key, 
-            UpdateExpression='SET active = :disable',
-            ExpressionAttributeValues={ ':disable': {'S': 'false'} } )
-        print({'action': 'deactivate', 'item': key})
-        return True
-    except Exception as e:
-        print({'error': str(e)})
-        return False
+def apply_image_lifecycle(project_id, keep=()):
+    """Deprecate, obsolete and delete the family's images in one pass over a single listing."""
+    client = images_client()
+    policy = lifecycle_policy(deprecate_interval, obsoleted_interval, delete_interval)
+    metadata_writer = MetadataWriter(get_dynamodb_client(project_id), image_table)
+    outcomes = run_lifecycle(client, project_id, policy, f"family={image_family}", keep=keep
+    , on_obsolete=metadata_writer.deactivate)
+    print("metadata", metadata_writer.flush())
+    return lifecycle_status(outcomes)
 
 def deprecate_gcp_image(project_id, image_name):
-    client = compute_v1.ImagesClient()
-    oldest = datetime.now(timezone.utc) - timedelta(days=deprecate_interval)
-    filter_str = f"family={image_family} AND status=READY AND name!={image_name}"
-    request = compute_v1.ListImagesRequest(project=project_id, filter=filter_str)
-    images = client.list(request=request)
-    deprecation_status = compute_v1.DeprecationStatus(state="DEPRECATED")
-    for image in images:
-        try:
-            creation_date = datetime.strptime(image.creation_timestamp,"%Y-%m-%dT%H:%M:%S.%f%z")
-            creation_date = creation_date.astimezone(pytz.UTC)
-            if creation_date < oldest and str(image.deprecated.state) == "":
-                client.deprecate(project=project_id, image=image.name
-                , deprecation_status_resource=deprecation_status)
-                print(f" Deprecated image {image.name}.")
-                # break
-        except Exception as e:
-            logger.error(f"Failed to deprecate image {image.name}: {e}")
-            return False, e
-    return True, None
+    client = images_client()
+    policy = lifecycle_policy(deprecate_days=deprecate_interval)
+    return lifecycle_status(run_lifecycle(client, project_id, policy, f"family={image_family}", keep=[image_name]))
 
 def obsolete_gcp_image(project_id):
-    client = compute_v1.ImagesClient()
-    oldest = datetime.now(timezone.utc) - timedelta(days=obsoleted_interval)
-    filter_str = f"deprecated.state=DEPRECATED AND family={image_family}"
-    request = compute_v1.ListImagesRequest(project=project_id, filter=filter_str)
-    images = client.list(request=request)
-    obsoleted_status = compute_v1.DeprecationStatus(state="OBSOLETE")
-    aws_access_key = get_secret_gcp(os.getenv('aws_access_key',"aws-access-key"))
-    aws_secret_key = get_secret_gcp(os.getenv('aws_secret_key',"aws-secret-key"))
-    db_client = boto3.client('dynamodb', region_name='us-east-1'
-    , aws_access_key_id=aws_access_key, aws_secret_access_key=aws_secret_key)
-    for image in images:
-        try:
-            creation_date = datetime.strptime(image.creation_timestamp,"%Y-%m-%dT%H:%M:%S.%f%z")
-            creation_date = creation_date.astimezone(pytz.UTC)
-            if creation_date < oldest:
-                client.deprecate(project=project_id, image=image.name
-                , deprecation_status_resource=obsoleted_status)
-                print(f"Obsoleted image {image.name}.")
-                update_dynamodb_inactive(db_client, image.name)
-                # break
-        except Exception as e:
-            logger.error(f"Failed to obsolete image {image.name}: {e}")
-            return False, e
-    return True, None
+    client = images_client()
+    policy = lifecycle_policy(obsolete_days=obsoleted_interval)
+    metadata_writer = MetadataWriter(get_dynamodb_client(project_id), image_table)
+    outcomes = run_lifecycle(client, project_id, policy, f"family={image_family}"
+    , on_obsolete=metadata_writer.deactivate)
+    print("metadata", metadata_writer.flush())
+    return lifecycle_status(outcomes)
 
 def delete_gcp_image(project_id):
-    client = compute_v1.ImagesClient()
-    oldest = datetime.now(timezone.utc) - timedelta(days=delete_interval)
-    filter_str = f"deprecated.state=OBSOLETE AND family={image_family}"
-    request = compute_v1.ListImagesRequest(project=project_id, filter=filter_str)
-    images = client.list(request=request)
-    deleted_status = compute_v1.DeprecationStatus(state="DELETED")
-    for image in images:
-        try:
-            creation_date = datetime.strptime(image.creation_timestamp,"%Y-%m-%dT%H:%M:%S.%f%z")
-            creation_date = creation_date.astimezone(pytz.UTC)
-            if creation_date < oldest:
-                operation = client.delete(project=project_id, image=image.name)
-                operation.result()
-                print(f"Deleted image {image.name}.")
-        except Exception as e:
-            logger.error(f"Failed to delete image {image.name}: {e}")
-            return False, e
-    return True, None
+    client = images_client()
+    policy = lifecycle_policy(delete_days=delete_interval)
+    return lifecycle_status(run_lifecycle(client, project_id, policy, f"family={image_family}"))
 
 
 @logger.catch
@@ -108,7 +56,10 @@ def main():
     print("Inside main")
     # status, status_msg = obsolete_gcp_image(project_id)
     # status, status_msg = delete_gcp_image(project_id)
-    if case_no == 1:
+    if case_no == 0:
+        print("case_no", case_no)
+        status, status_msg = apply_image_lifecycle(project_id)
+    elif case_no == 1:
         print("case_no", case_no)
         status, status_msg = deprecate_gcp_image(project_id, 'gim-rhel-9-2024-11-28-092347')
     elif case_no == 2:
@@ -119,6 +70,7 @@ def main():
         status, status_msg = delete_gcp_image(project_id)
     print("status", status)
     print("status_msg", status_msg)
+    log_client_stats()
 
 if __name__ == '__main__':
     main()
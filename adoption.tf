@@ -30,6 +30,7 @@ resource "google_cloudfunctions2_function" "adoption_function" {
     environment_variables = {
       BUCKET_NAME = google_storage_bucket.gcp_build.name
       PROJECT_ID  = var.project_id
+      SCAN_WORKERS = 16
     }
 
   }
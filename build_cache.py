@@ -0,0 +1,68 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime, timezone
+from gcp_clients import images_client
+
+logger = logging.getLogger()
+
+build_cache_table = os.getenv('BUILD_CACHE_TABLE') or os.getenv('dynamodb_table')  # Defaults to the image metadata table
+# Partition key value for cache items, so they never mix with the 'gcp' image metadata records
+BUILD_CACHE_CSP = 'gcp-build-key'
+RUNNING_BUILD_STATUSES = {"PENDING", "QUEUED", "WORKING"}
+
+
+def resolve_source_image_id(image):
+    """Id of the image the family currently points at, e.g. the latest rhel-9 in rhel-cloud."""
+    source = images_client().get_from_family(project=image.get("image_project"), family=image.get("source_image_family"))
+    return str(source.id)
+
+
+def build_key(source_image_id, image, bundle_generation):
+    """Hash of everything a build depends on: source image, supported_images entry and codebuild.zip generation."""
+    content = json.dumps([source_image_id, image, str(bundle_generation)], sort_keys=True)
+    return hashlib.sha256(content.encode("UTF-8")).hexdigest()
+
+
+class BuildKeyCache:
+    """Last build key, build id and status per image family, kept in the image metadata DynamoDB table."""
+
+    def __init__(self, db_client=None, table=None):
+        # boto3 is only imported once a cache is actually used
+        from metadata_writer import get_dynamodb_client
+        self.db_client = db_client or get_dynamodb_client()
+        self.table = table or build_cache_table
+
+    def get(self, image_name):
+        response = self.db_client.get_item(TableName=self.table, ConsistentRead=True, Key={
+            'csp': {'S': BUILD_CACHE_CSP}, 'image_name': {'S': image_name}})
+        item = response.get('Item')
+        if not item:
+            return None
+        return {field: value['S'] for field, value in item.items()}
+
+    def put(self, image_name, key, build_id, status):
+        self.db_client.put_item(TableName=self.table, Item={
+            'csp': {'S': BUILD_CACHE_CSP},
+            'image_name': {'S': image_name},
+            'build_key': {'S': key},
+            'build_id': {'S': build_id},
+            'status': {'S': status},
+            'updated_at': {'S': datetime.now(timezone.utc).isoformat()},
+        })
+
+    def is_current(self, image_name, key, build_client=None, project_id=None):
+        """True if the last build with this key succeeded, or is still running, so a new build would repeat it.
+
+        A build recorded while still running is looked up once with get_build and its final status stored.
+        """
+        entry = self.get(image_name)
+        if not entry or entry.get('build_key') != key:
+            return False
+        status = entry.get('status')
+        if status in RUNNING_BUILD_STATUSES and build_client:
+            status = build_client.get_build(project_id=project_id, id=entry['build_id']).status.name
+            if status not in RUNNING_BUILD_STATUSES:
+                self.put(image_name, key, entry['build_id'], status)
+        return status == "SUCCESS" or status in RUNNING_BUILD_STATUSES
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import uuid
+import logging
+import itertools
+from gcp_clients import storage_client
+
+logger = logging.getLogger()
+
+build_max_in_flight = int(os.getenv('BUILD_MAX_IN_FLIGHT', '10'))  # Keep below the project's concurrent build quota
+default_priority = int(os.getenv('BUILD_DEFAULT_PRIORITY', '100'))  # Lower runs first
+scheduler_lease_seconds = int(os.getenv('SCHEDULER_LEASE_SECONDS', '300'))
+# A tick holds the lease for a few seconds, so a busy queue is retried this many times, waiting 1s, 2s, 4s... between
+scheduler_acquire_attempts = int(os.getenv('SCHEDULER_ACQUIRE_ATTEMPTS', '5'))
+
+FINISHED_STATUSES = {"SUCCESS", "FAILURE", "INTERNAL_ERROR", "TIMEOUT", "CANCELLED", "EXPIRED", "SUBMIT_FAILED"}
+
+
+class SchedulerBusy(Exception):
+    """Another invocation holds the queue lease or changed the queue underneath this one."""
+
+
+class GcsStateStore:
+    """Queue state as one JSON object; writes use generation preconditions so invocations cannot clobber each other."""
+
+    def __init__(self, bucket_name, object_name):
+        self.blob = storage_client().bucket(bucket_name).blob(object_name)
+
+    def load(self):
+        if not self.blob.exists():
+            return {"entries": {}, "lease": None}, 0
+        self.blob.reload()
+        return json.loads(self.blob.download_as_text(if_generation_match=self.blob.generation)), self.blob.generation
+
+    def save(self, state, token):
+        from google.api_core.exceptions import PreconditionFailed
+        try:
+            self.blob.upload_from_string(json.dumps(state), content_type='application/json', if_generation_match=token)
+        except PreconditionFailed as e:
+            raise SchedulerBusy(str(e))
+        return self.blob.generation
+
+
+class MemoryStateStore:
+    """In-process stand-in for GcsStateStore with the same conflict behaviour."""
+
+    def __init__(self):
+        self.content, self.generation = None, 0
+
+    def load(self):
+        if self.content is None:
+            return {"entries": {}, "lease": None}, 0
+        return json.loads(self.content), self.generation
+
+    def save(self, state, token):
+        if token != self.generation:
+            raise SchedulerBusy(f"generation {token} is stale, current is {self.generation}")
+        self.content, self.generation = json.dumps(state), self.generation + 1
+        return self.generation
+
+
+class CloudBuildBackend:
+    """Submits through `submit_build(name, image)`, which returns the build id, and reads the statuses of all
+    running builds with one list_builds call filtered to their ids (at most max_in_flight of them)."""
+
+    def __init__(self, client, project_id, submit_build):
+        self.client = client
+        self.project_id = project_id
+        self.submit_build = submit_build
+
+    def submit(self, name, image):
+        return self.submit_build(name, image)
+
+    def statuses(self, build_ids):
+        build_filter = " OR ".join(f'build_id="{build_id}"' for build_id in build_ids)
+        return {build.id: build.status.name
+                for build in self.client.list_builds(project_id=self.project_id, filter=build_filter)}
+
+
+class FakeBuildBackend:
+    """Local backend for exercising the scheduler: every build finishes after `ticks_to_finish` status reads."""
+
+    def __init__(self, ticks_to_finish=2, final_status="SUCCESS"):
+        self.ticks_to_finish = ticks_to_finish
+        self.final_status = final_status
+        self.builds = {}
+        self.submitted = []
+        self.ids = itertools.count(1)
+
+    def submit(self, name, image):
+        build_id = f"fake-{next(self.ids)}"
+        self.builds[build_id] = {"name": name, "ticks": 0, "status": "QUEUED"}
+        self.submitted.append(name)
+        return build_id
+
+    def finish(self, build_id, status="SUCCESS"):
+        self.builds[build_id]["status"] = status
+
+    def statuses(self, build_ids):
+        result = {}
+        for build_id in build_ids:
+            build = self.builds[build_id]
+            build["ticks"] += 1
+            if build["status"] not in FINISHED_STATUSES and build["ticks"] >= self.ticks_to_finish:
+                build["status"] = self.final_status
+            elif build["status"] == "QUEUED":
+                build["status"] = "WORKING"
+            result[build_id] = build["status"]
+        return result
+
+
+class BuildScheduler:
+    """Priority queue of image builds admitted under a global max-in-flight limit.
+
+    The queue lives in a state store rather than in the function, so each invocation (`tick`, e.g. from
+    Cloud Scheduler) picks up where the last one stopped: it refreshes running builds, then admits queued
+    ones by priority as slots free up. A lease keeps two invocations from admitting builds at once.
+    """
+
+    def __init__(self, backend, store, max_in_flight=build_max_in_flight, on_finished=None):
+        self.backend = backend
+        self.store = store
+        self.max_in_flight = max_in_flight
+        self.on_finished = on_finished  # on_finished(name, entry) once a build reaches a final status
+        self.owner = uuid.uuid4().hex
+
+    def _try_acquire(self):
+        state, token = self.store.load()
+        lease = state.get("lease")
+        if lease and lease["owner"] != self.owner and lease["until"] > time.time():
+            raise SchedulerBusy(f"queue is leased until {lease['until']}")
+        state["lease"] = {"owner": self.owner, "until": time.time() + scheduler_lease_seconds}
+        return state, self.store.save(state, token)
+
+    def _acquire(self, attempts=None):
+        attempts = scheduler_acquire_attempts if attempts is None else attempts
+        for attempt in range(1, max(1, attempts) + 1):
+            try:
+                return self._try_acquire()
+            except SchedulerBusy as e:
+                if attempt >= attempts:
+                    raise
+                logger.info(f"Build queue busy ({e}), retrying")
+                time.sleep(2 ** (attempt - 1))
+
+    def _release(self, state, token):
+        state["lease"] = None
+        return self.store.save(state, token)
+
+    def _notify(self, name, entry):
+        """Run on_finished; a failing hook (e.g. the build cache being down) must not stall the queue."""
+        if not self.on_finished:
+            return
+        try:
+            self.on_finished(name, entry)
+        except Exception as e:
+            logger.error(f"on_finished failed for {name}: {e}")
+
+    def enqueue(self, images):
+        """Queue (name, image, priority, extra) tuples; an image already queued or running is left as it is."""
+        state, token = self._acquire()
+        entries = state["entries"]
+        added = 0
+        for name, image, priority, extra in images:
+            entry = entries.get(name)
+            if entry and entry["state"] in ("queued", "running"):
+                continue
+            entries[name] = {"state": "queued", "priority": default_priority if priority is None else priority,
+                             "enqueued_at": time.time(), "image": image, "build_id": None, "status": None,
+                             **(extra or {})}
+            added += 1
+        self._release(state, token)
+        logger.info(f"Queued {added} builds")
+        return added
+
+    def tick(self):
+        """Refresh running builds, admit queued builds into free slots and return a summary of the queue."""
+        state, token = self._acquire()
+        entries = state["entries"]
+        try:
+            running = {entry["build_id"]: name for name, entry in entries.items() if entry["state"] == "running"}
+            if running:
+                for build_id, status in self.backend.statuses(list(running)).items():
+                    entry = entries[running[build_id]]
+                    entry["status"] = status
+                    if status in FINISHED_STATUSES:
+                        entry["state"] = "done"
+                        entry["finished_at"] = time.time()
+                        self._notify(running[build_id], entry)
+
+            in_flight = sum(1 for entry in entries.values() if entry["state"] == "running")
+            queued = sorted((name for name, entry in entries.items() if entry["state"] == "queued"),
+                            key=lambda name: (entries[name]["priority"], entries[name]["enqueued_at"]))
+            for name in queued[:max(0, self.max_in_flight - in_flight)]:
+                entry = entries[name]
+                try:
+                    entry["build_id"] = self.backend.submit(name, entry["image"])
+                    entry.update(state="running", status="QUEUED", started_at=time.time())
+                    logger.info(f"Admitted build for {name} (priority {entry['priority']})")
+                except Exception as e:
+                    logger.error(f"Failed to submit build for {name}: {e}")
+                    entry.update(state="done", status="SUBMIT_FAILED", error=str(e))
+                    self._notify(name, entry)
+                # Save after each admission so a crash never loses track of a submitted build
+                token = self.store.save(state, token)
+        finally:
+            # Released even when a status lookup fails, so the next tick is not locked out for the lease period
+            self._release(state, token)
+        return self.summary(entries)
+
+    @staticmethod
+    def summary(entries):
+        counts = {"queued": 0, "running": 0, "done": 0}
+        for entry in entries.values():
+            counts[entry["state"]] += 1
+        return {**counts, "builds": {name: {"state": entry["state"], "status": entry["status"],
+                                            "build_id": entry["build_id"], "priority": entry["priority"]}
+                                     for name, entry in entries.items()}}
@@ -1,10 +1,12 @@
 import os
 import json
 import pytz
-import time
 import logging
 import traceback
-from google.cloud import compute_v1
+from inventory_store import InventoryStore, instance_view
+from gcp_clients import instances_client, log_stats as log_client_stats, snapshot_stats as snapshot_client_stats
+from vm_cleanup import (wait_for_operations, list_instances_all_zones, stale_instance_filter, is_protected
+, is_older_than, delete_instances_by_zone, SCAN_VM_LABEL_FILTER)
 from datetime import datetime, timezone, timedelta
 
 # Initialize logging
@@ -14,9 +16,17 @@ logging.basicConfig(level=logging.INFO)
 zone = 'us-east1-b'
 delete_interval = 1
 project_id = os.getenv('PROJECT_ID')  # Google Cloud Project ID
+cleanup_all_zones = os.getenv('CLEANUP_ALL_ZONES', 'false').lower() == 'true'  # Sweep every zone, not just `zone`
+# Scope of the all-zones sweep, e.g. labels.purpose = "image-scan"; required, since without it every old VM is in scope
+cleanup_label_filter = os.getenv('CLEANUP_LABEL_FILTER', SCAN_VM_LABEL_FILTER)
+use_inventory = os.getenv('USE_INVENTORY', 'false').lower() == 'true'  # Read instances from the shared inventory store
 
-def list_instances(project_id, zone):
-    instance_client = compute_v1.InstancesClient()
+def list_instances(project_id, zone, inventory=None):
+    if inventory:
+        inventory.sync_instances(project_id)
+        return [instance_view(row) for row in inventory.instances(project_id, zone)]
+    from google.cloud import compute_v1
+    instance_client = instances_client()
     request = compute_v1.ListInstancesRequest(project=project_id, zone=zone)
     instances = []
 
@@ -31,28 +41,24 @@ def list_instances(project_id, zone):
     return instances
 
 def wait_for_operation(operation, project_id, zone):
-    operation_client = compute_v1.ZoneOperationsClient()
-    while True:
-        result = operation_client.get(project=project_id, zone=zone, operation=operation.name)
-        if result.status == compute_v1.Operation.Status.DONE:
-            logger.info("Delete completed.")
-            break
-        elif result.error:
-            raise Exception(f"Error during operation: {result.error}")
-        else:
-            logger.info("Waiting for delete operation to complete...")
-            time.sleep(5)
+    error = wait_for_operations(project_id, [(zone, operation.name, operation)]).get(operation.name)
+    if error:
+        raise Exception(f"Error during operation: {error}")
 
 def delete_instance(project_id, zone, instance_name, instance_client):
+    """Submit the delete and return its operation without waiting for it."""
     operation = instance_client.delete(project=project_id, zone=zone, instance=instance_name)
     logger.info(f"Deleting instance {instance_name} in project {project_id}, zone {zone}...")
-    wait_for_operation(operation, project_id, zone)
+    return operation
 
 def delete_gcp_vm(project_id):
-    instances = list_instances(project_id, zone)
-    instance_client = compute_v1.InstancesClient()
+    inventory = InventoryStore.open_shared() if use_inventory else None
+    instances = list_instances(project_id, zone, inventory)
+    instance_client = instances_client()
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=delete_interval)
 
+    operations = []
+    errors = {}
     for instance in instances:
         if "do-not-delete-vm" in instance.labels and instance.labels["do-not-delete-vm"] == 'true':
             continue
@@ -60,15 +66,54 @@ def delete_gcp_vm(project_id):
         creation_timestamp = datetime.strptime(instance.creation_timestamp,"%Y-%m-%dT%H:%M:%S.%f%z")
         creation_timestamp = creation_timestamp.astimezone(pytz.UTC)            
         if creation_timestamp < cutoff_date:
-            delete_instance(project_id, zone, instance.name, instance_client)
+            try:
+                operations.append((zone, instance.name, delete_instance(project_id, zone, instance.name, instance_client)))
+            except Exception as e:
+                logger.error(f"Failed to submit delete for instance {instance.name}: {e}")
+                errors[instance.name] = str(e)
+
+    # Every delete is in flight now; wait for all of them at once
+    results = wait_for_operations(project_id, operations)
+    for instance_name, error in results.items():
+        if error:
+            errors[instance_name] = error
+        elif inventory:
+            inventory.forget_instance(project_id, zone, instance_name)
+
+    if inventory:
+        inventory.save_shared()
+    deleted = len(results) - len([e for e in results.values() if e])
+    response = {"statusCode": 500 if errors else 200, "message": f"Deleted {deleted} instances", "deleted": deleted}
+    if errors:
+        response["errors"] = errors
+    return response
+
+def delete_gcp_vm_all_zones(project_id):
+    """Find stale VMs in every zone with one filtered aggregated listing and delete them zone by zone in parallel."""
+    if not cleanup_label_filter:
+        logger.error("CLEANUP_ALL_ZONES needs a CLEANUP_LABEL_FILTER, refusing to sweep every VM in the project")
+        return {"statusCode": 400, "message": "CLEANUP_LABEL_FILTER is required with CLEANUP_ALL_ZONES", "deleted": 0}
+    cutoff_date = datetime.now(timezone.utc) - timedelta(days=delete_interval)
+    instances = list_instances_all_zones(project_id, stale_instance_filter(delete_interval, cleanup_label_filter))
+    stale = [(instance_zone, instance.name) for instance_zone, instance in instances
+             if not is_protected(instance) and is_older_than(instance, cutoff_date)]
+    logger.info(f"Found {len(stale)} stale instances across {len({z for z, _ in stale})} zones.")
 
-    return {"statusCode": 200, "message": "Images deleted successfully"}
+    results = delete_instances_by_zone(project_id, stale)
+    errors = {key: error for key, error in results.items() if error}
+    deleted = len(results) - len(errors)
+    response = {"statusCode": 500 if errors else 200, "message": f"Deleted {deleted} instances", "deleted": deleted}
+    if errors:
+        response["errors"] = errors
+    return response
 
 def main(request=None):
     """HTTP Cloud Function to delete VM."""
+    client_stats = snapshot_client_stats()
     try:
         logger.info("Starting the main function...")
-        response = delete_gcp_vm(project_id)
+        response = delete_gcp_vm_all_zones(project_id) if cleanup_all_zones else delete_gcp_vm(project_id)
+        log_client_stats(client_stats)
         logger.info(f"Function executed successfully. Response: {response}")
         return ( json.dumps(response), response.get("statusCode", 500), {"Content-Type": "application/json"}, )
     except Exception as e:
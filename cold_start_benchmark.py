@@ -0,0 +1,111 @@
+"""Cold-start benchmark for the Cloud Function entry points.
+
+Each measurement runs in a fresh interpreter, like a new function instance: it loads the entry
+module and, with --call, invokes its handler once (this needs credentials and real resources).
+The result is the time to the first request plus the heavy libraries the module pulled in at load.
+
+    python cold_start_benchmark.py --runs 5 --output cold-start.json
+    python cold_start_benchmark.py --baseline cold-start.json --tolerance 0.25
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ENTRY_POINTS = {
+    "gcp_trigger": ("Gcp_trigger.py", "main"),
+    "adoption": ("Adoption.py", "main"),
+    "obsolete": ("obsolete.py", "main"),
+    "delete_old_image": ("delete_old_image.py", "main"),
+    "clean_old_vm": ("clean-old-vm.py", "main"),
+    "disk_sweeper": ("disk_sweeper.py", "main"),
+    "lifecycle_handler": ("lifecycle_handler.py", "lifecycle_handler"),
+}
+
+HEAVY_MODULES = ["pandas", "numpy", "boto3", "requests", "openpyxl", "pyarrow", "google.cloud.storage",
+                 "google.cloud.compute_v1", "google.cloud.resourcemanager_v3", "google.cloud.secretmanager",
+                 "google.cloud.devtools.cloudbuild_v1"]
+
+PROBE = """
+import sys, json, time, importlib.util
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("entry", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+loaded = time.perf_counter()
+if sys.argv[3] == "call":
+    getattr(module, sys.argv[2])(None)
+finished = time.perf_counter()
+print(json.dumps({"import_seconds": loaded - started, "first_request_seconds": finished - started,
+                  "heavy_modules": [name for name in json.loads(sys.argv[4]) if name in sys.modules]}))
+"""
+
+
+def measure(path, handler, call):
+    result = subprocess.run([sys.executable, "-c", PROBE, path, handler, "call" if call else "import",
+                             json.dumps(HEAVY_MODULES)], capture_output=True, text=True, cwd=os.path.dirname(path))
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark(names, runs, call):
+    here = os.path.dirname(os.path.abspath(__file__))
+    report = {}
+    for name in names:
+        path, handler = ENTRY_POINTS[name]
+        samples = [measure(os.path.join(here, path), handler, call) for _ in range(runs)]
+        errors = [sample["error"] for sample in samples if "error" in sample]
+        if errors:
+            report[name] = {"error": errors[0]}
+            continue
+        report[name] = {
+            "import_seconds": round(statistics.median(s["import_seconds"] for s in samples), 4),
+            "first_request_seconds": round(statistics.median(s["first_request_seconds"] for s in samples), 4),
+            "heavy_modules": samples[0]["heavy_modules"],
+        }
+    return report
+
+
+def regressions(report, baseline, tolerance):
+    """Entry points whose median time grew by more than `tolerance` (a fraction) over the baseline."""
+    found = []
+    for name, result in report.items():
+        previous = baseline.get(name, {})
+        if "first_request_seconds" not in result or "first_request_seconds" not in previous:
+            continue
+        if result["first_request_seconds"] > previous["first_request_seconds"] * (1 + tolerance):
+            found.append(f"{name}: {previous['first_request_seconds']}s -> {result['first_request_seconds']}s")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("entry_points", nargs="*", help=f"any of {', '.join(ENTRY_POINTS)} (default: all)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--call", action="store_true", help="invoke each handler once after loading it")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="previous --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    unknown = set(args.entry_points) - set(ENTRY_POINTS)
+    if unknown:
+        parser.error(f"unknown entry points: {', '.join(sorted(unknown))}")
+
+    report = benchmark(args.entry_points or list(ENTRY_POINTS), args.runs, args.call)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            found = regressions(report, json.load(baseline), args.tolerance)
+        for line in found:
+            print(f"Cold start regression: {line}", file=sys.stderr)
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 import os
 import json
-import pytz
 import logging
-from google.cloud import compute_v1
-from datetime import datetime, timezone, timedelta
+import traceback
+from gcp_clients import images_client
+from lifecycle_engine import lifecycle_policy, run_lifecycle_across_projects, summarize
 
 # Initialize logging
 logger = logging.getLogger()
@@ -11,43 +11,32 @@ logging.basicConfig(level=logging.INFO)
 
 delete_interval = 365
 project_id = os.getenv('PROJECT_ID')  # Google Cloud Project ID
-image_families = os.getenv('image_families').split(",")
-
-logger.info(f"image_families {image_families}.")
+image_families = [f for f in os.getenv('image_families', '').split(",") if f]
+image_projects = [p for p in os.getenv('image_projects', '').split(",") if p]  # Defaults to PROJECT_ID
+use_inventory = os.getenv('USE_INVENTORY', 'false').lower() == 'true'  # Read images from the shared inventory store
 
 def delete_gcp_image(project_id):
-    client = compute_v1.ImagesClient()
-    oldest = datetime.now(timezone.utc) - timedelta(days=delete_interval)
-    deleted_status = compute_v1.DeprecationStatus(state="DELETED")
-    for image_family in image_families:    
-        filter_str = f"deprecated.state=OBSOLETE AND family={image_family}"
-        request = compute_v1.ListImagesRequest(project=project_id, filter=filter_str)
-        request.max_results = 300
-        while True:
-            images = client.list(request=request)
-            for image in images:
-                try:
-                    creation_date = datetime.strptime(image.creation_timestamp,"%Y-%m-%dT%H:%M:%S.%f%z")
-                    creation_date = creation_date.astimezone(pytz.UTC)
-                    if creation_date < oldest:
-                        operation = client.delete(project=project_id, image=image.name)
-                        operation.result()
-                        logger.info(f"Deleted image {image.name}.")
-                except Exception as e:
-                    logger.error(f"Failed to delete image {image.name}: {e}")
-                    return {"statusCode": 500, "error": str(e)}
-
-            if images.next_page_token:
-                request.page_token = images.next_page_token
-            else:
-                break
+    from inventory_store import InventoryStore
+    logger.info(f"image_families {image_families}.")
+    client = images_client()
+    policy = lifecycle_policy(delete_days=delete_interval)
+    inventory = InventoryStore.open_shared() if use_inventory else None
+    outcomes = run_lifecycle_across_projects(client, image_projects or [project_id], image_families, policy, inventory=inventory)
+    if inventory:
+        inventory.save_shared()
 
-    return {"statusCode": 200, "message": "Images deleted successfully"}
+    summary = summarize(outcomes)
+    images = {outcome["image"]: outcome["error"] or "deleted" for outcome in outcomes}
+    if summary["failed"]:
+        return {"statusCode": 500, "error": summary["errors"], "images": images}
+    return {"statusCode": 200, "message": "Images deleted successfully", "images": images}
 
 def main(request=None):
     """HTTP Cloud Function to delete images."""
     try:
         logger.info("Starting the main function...")
+        if not image_families:
+            return ( json.dumps({"error": "image_families is not set"}), 400, {"Content-Type": "application/json"}, )
         response = delete_gcp_image(project_id)
         logger.info(f"Function executed successfully. Response: {response}")
         return ( json.dumps(response), response.get("statusCode", 500), {"Content-Type": "application/json"}, )
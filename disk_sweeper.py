@@ -0,0 +1,177 @@
+import os
+import json
+import logging
+import tempfile
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from gcp_clients import disks_client, snapshots_client, log_stats as log_client_stats, snapshot_stats as snapshot_client_stats
+from report_writer import open_report_writer, upload_report
+from vm_cleanup import PROTECT_LABEL
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)
+
+project_id = os.getenv('PROJECT_ID')  # Google Cloud Project ID
+disk_min_age_days = int(os.getenv('ORPHAN_DISK_MIN_AGE_DAYS', '7'))
+snapshot_min_age_days = int(os.getenv('ORPHAN_SNAPSHOT_MIN_AGE_DAYS', '30'))
+sweep_label = os.getenv('SWEEP_LABEL')  # key=value label an orphan must carry, e.g. source=packer
+sweep_name_prefixes = [p for p in os.getenv('SWEEP_NAME_PREFIXES', '').split(",") if p]  # One of the two is required to sweep anything
+sweep_dry_run = os.getenv('SWEEP_DRY_RUN', 'true').lower() == 'true'  # Only report what would be deleted
+sweep_workers = int(os.getenv('SWEEP_WORKERS', '16'))  # Deletes in flight at once
+sweep_report_bucket = os.getenv('SWEEP_REPORT_BUCKET')
+operation_timeout = int(os.getenv('OPERATION_TIMEOUT_SECONDS', '900'))
+
+SWEEP_PROTECT_LABEL = "do-not-delete"
+REPORT_COLUMNS = ["Kind", "Name", "Zone", "Size GB", "Created", "Reason", "Action", "Error"]
+
+
+def list_disks_all_zones(project_id, filter_str=None):
+    """Every disk of a project as (zone, disk) pairs, from one paged aggregated listing."""
+    from google.cloud import compute_v1
+    disk_client = disks_client()
+    request = compute_v1.AggregatedListDisksRequest(project=project_id, filter=filter_str, max_results=500)
+    disks = []
+    for zone, scoped_list in disk_client.aggregated_list(request=request):
+        for disk in scoped_list.disks:
+            disks.append((zone.split('/')[-1], disk))
+    return disks
+
+
+def list_snapshots(project_id, filter_str=None):
+    from google.cloud import compute_v1
+    snapshot_client = snapshots_client()
+    request = compute_v1.ListSnapshotsRequest(project=project_id, filter=filter_str, max_results=500)
+    return list(snapshot_client.list(request=request))
+
+
+def in_scope(resource, cutoff):
+    """Shared age, protect-label and name rules for disks and snapshots."""
+    labels = resource.labels
+    if labels.get(SWEEP_PROTECT_LABEL) == 'true' or labels.get(PROTECT_LABEL) == 'true':
+        return False
+    if sweep_label:
+        key, _, value = sweep_label.partition('=')
+        if labels.get(key) != value:
+            return False
+    if sweep_name_prefixes and not any(resource.name.startswith(prefix) for prefix in sweep_name_prefixes):
+        return False
+    return datetime.strptime(resource.creation_timestamp, "%Y-%m-%dT%H:%M:%S.%f%z") < cutoff
+
+
+def find_orphans(disks, snapshots, now=None):
+    """Return report rows for unattached disks and for snapshots whose source disk no longer exists.
+
+    `disks` must be the full disk listing: it is also the index of disks that still exist.
+    """
+    now = now or datetime.now(timezone.utc)
+    disk_cutoff = now - timedelta(days=disk_min_age_days)
+    snapshot_cutoff = now - timedelta(days=snapshot_min_age_days)
+    existing = {disk.self_link for _, disk in disks}
+
+    orphans = []
+    for zone, disk in disks:
+        if not disk.users and in_scope(disk, disk_cutoff):
+            orphans.append({"Kind": "disk", "Name": disk.name, "Zone": zone, "Size GB": disk.size_gb,
+                            "Created": disk.creation_timestamp, "Reason": "not attached to any instance"})
+    for snapshot in snapshots:
+        if snapshot.source_disk and snapshot.source_disk not in existing and in_scope(snapshot, snapshot_cutoff):
+            orphans.append({"Kind": "snapshot", "Name": snapshot.name, "Zone": None, "Size GB": snapshot.disk_size_gb,
+                            "Created": snapshot.creation_timestamp, "Reason": "source disk deleted"})
+    return orphans
+
+
+def delete_orphans(project_id, orphans, workers=sweep_workers):
+    """Delete orphans with at most `workers` operations in flight; each row gets its Action and Error filled in."""
+    disk_client = disks_client()
+    snapshot_client = snapshots_client()
+
+    def delete(orphan):
+        try:
+            if orphan["Kind"] == "disk":
+                operation = disk_client.delete(project=project_id, zone=orphan["Zone"], disk=orphan["Name"])
+            else:
+                operation = snapshot_client.delete(project=project_id, snapshot=orphan["Name"])
+            operation.result(timeout=operation_timeout)
+            logger.info(f"Deleted {orphan['Kind']} {orphan['Name']}.")
+            return dict(orphan, Action="deleted", Error=None)
+        except Exception as e:
+            logger.error(f"Failed to delete {orphan['Kind']} {orphan['Name']}: {e}")
+            return dict(orphan, Action="failed", Error=str(e))
+
+    if not orphans:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(orphans)))) as executor:
+        return list(executor.map(delete, orphans))
+
+
+def write_report(rows):
+    report_file = tempfile.NamedTemporaryFile(suffix='.csv.gz', delete=False)
+    report_file.close()
+    report = open_report_writer('csv.gz', report_file.name, REPORT_COLUMNS)
+    report.write_rows(rows)
+    report.close()
+    name = f"orphan-sweeps/{datetime.now(timezone.utc).strftime('%Y-%m-%dT%H%M%S')}.{report.extension}"
+    upload_report(sweep_report_bucket, name, report.path, report.content_type)
+    return name
+
+
+def sweep_orphans(project_id, dry_run=sweep_dry_run):
+    """One pass: list all disks and snapshots once, find orphans, then delete them concurrently unless dry_run."""
+    # The disk listing stays unfiltered because it is also the index of disks that still exist
+    disks = list_disks_all_zones(project_id)
+    snapshot_filter = None
+    if sweep_label:
+        key, _, value = sweep_label.partition('=')
+        snapshot_filter = f'labels.{key} = "{value}"'
+    snapshots = list_snapshots(project_id, snapshot_filter)
+    orphans = find_orphans(disks, snapshots)
+    logger.info(f"Found {len(orphans)} orphans among {len(disks)} disks and {len(snapshots)} snapshots.")
+
+    # A detached data disk or a snapshot outliving its disk may well be kept on purpose, so nothing is
+    # swept without an explicit scope naming what this job's builds and scans leave behind
+    skipped = []
+    if not (sweep_label or sweep_name_prefixes):
+        skipped = [dict(orphan, Action="skipped", Error="set SWEEP_LABEL or SWEEP_NAME_PREFIXES to sweep")
+                   for orphan in orphans]
+        orphans = []
+        if skipped:
+            logger.warning(f"Skipping {len(skipped)} orphan candidates: no SWEEP_LABEL or SWEEP_NAME_PREFIXES set.")
+
+    if dry_run:
+        rows = [dict(orphan, Action="would delete", Error=None) for orphan in orphans]
+    else:
+        rows = delete_orphans(project_id, orphans)
+    failed = [row for row in rows if row["Action"] == "failed"]
+    response = {
+        "statusCode": 500 if failed else 200,
+        "dry_run": dry_run,
+        "orphans": len(rows),
+        "failed": len(failed),
+        "skipped": len(skipped),
+        "reclaimable_gb": sum(row["Size GB"] or 0 for row in rows if row["Action"] != "failed"),
+    }
+    rows += skipped
+    if sweep_report_bucket:
+        response["report"] = write_report(rows)
+    else:
+        response["rows"] = rows
+    return response
+
+
+def main(request=None):
+    """HTTP Cloud Function to sweep orphaned disks and snapshots."""
+    client_stats = snapshot_client_stats()
+    try:
+        response = sweep_orphans(project_id)
+        log_client_stats(client_stats)
+        logger.info(f"Function executed successfully. Response: {response}")
+        return ( json.dumps(response), response.get("statusCode", 500), {"Content-Type": "application/json"}, )
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        logger.error("".join(traceback.format_exc()))  # Log full traceback
+        return ( json.dumps({"error": "Internal Server Error"}), 500, {"Content-Type": "application/json"},)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import logging
+import importlib
+import threading
+
+logger = logging.getLogger()
+
+# Client kind -> (module, class). Modules are imported on first use so an entry point only pays
+# for the client libraries its invocation actually touches.
+CLIENT_CLASSES = {
+    "storage": ("google.cloud.storage", "Client"),
+    "cloud_build": ("google.cloud.devtools.cloudbuild_v1", "CloudBuildClient"),
+    "images": ("google.cloud.compute_v1", "ImagesClient"),
+    "instances": ("google.cloud.compute_v1", "InstancesClient"),
+    "disks": ("google.cloud.compute_v1", "DisksClient"),
+    "snapshots": ("google.cloud.compute_v1", "SnapshotsClient"),
+    "zone_operations": ("google.cloud.compute_v1", "ZoneOperationsClient"),
+    "projects": ("google.cloud.resourcemanager_v3", "ProjectsClient"),
+    "folders": ("google.cloud.resourcemanager_v3", "FoldersClient"),
+    "secret_manager": ("google.cloud.secretmanager", "SecretManagerServiceClient"),
+}
+
+_clients = {}
+_lock = threading.Lock()
+# Every client owns its own gRPC channel or HTTP session, so `created` is the number of channels opened
+stats = {"created": {}, "reused": 0}
+
+
+def get_client(kind):
+    """Return the process-wide client of a kind, importing its library and creating it on first use.
+
+    The Google Cloud clients are safe to share between threads, so one instance per kind serves the
+    whole process and every caller reuses its connections.
+    """
+    client = _clients.get(kind)
+    if client is None:
+        with _lock:
+            client = _clients.get(kind)
+            if client is None:
+                module_name, class_name = CLIENT_CLASSES[kind]
+                client = getattr(importlib.import_module(module_name), class_name)()
+                _clients[kind] = client
+                stats["created"][kind] = stats["created"].get(kind, 0) + 1
+                return client
+    with _lock:
+        stats["reused"] += 1
+    return client
+
+
+def snapshot_stats():
+    """Copy of the counters, taken at the start of a handler so log_stats can report just that invocation."""
+    with _lock:
+        return {"created": dict(stats["created"]), "reused": stats["reused"]}
+
+
+def log_stats(since=None):
+    """Log the channels created and clients reused since the `since` snapshot (or since process start).
+
+    The counters live as long as the process, so on a warm instance only the difference describes one run.
+    """
+    current = snapshot_stats()
+    created, reused = current["created"], current["reused"]
+    channels_open = sum(created.values())
+    if since:
+        created = {kind: count - since["created"].get(kind, 0) for kind, count in created.items()
+                   if count - since["created"].get(kind, 0)}
+        reused -= since["reused"]
+    result = {"channels_created": sum(created.values()), "by_kind": created, "reused": reused
+    , "channels_open": channels_open}
+    logger.info({'action': 'client-registry', **result})
+    return result
+
+
+def storage_client():
+    return get_client("storage")
+
+
+def cloud_build_client():
+    return get_client("cloud_build")
+
+
+def images_client():
+    return get_client("images")
+
+
+def instances_client():
+    return get_client("instances")
+
+
+def disks_client():
+    return get_client("disks")
+
+
+def snapshots_client():
+    return get_client("snapshots")
+
+
+def zone_operations_client():
+    return get_client("zone_operations")
+
+
+def projects_client():
+    return get_client("projects")
+
+
+def folders_client():
+    return get_client("folders")
+
+
+def secret_manager_client():
+    return get_client("secret_manager")
@@ -100,6 +100,7 @@ resource "google_cloudfunctions_function" "build_function" {
     namespace               = local.namespaces-
     kms_key                 = google_kms_crypto_key.crypto_key.id
     TOPIC_NAME              = data.aws_sns_topic.images_notification_topic.arn
+    BUILD_SCHEDULER         = var.build_scheduler
   }
 }
 
@@ -124,6 +125,30 @@ resource "google_cloud_scheduler_job" "build_trigger_job" {
   }
 }
 
+# With the build scheduler on, only BUILD_MAX_IN_FLIGHT builds are submitted at once; each tick
+# refreshes the running builds and admits queued ones as slots free up
+resource "google_cloud_scheduler_job" "build_tick_job" {
+  count       = var.environment != "local" && var.build_scheduler ? 1 : 0
+  name        = "${local.namespaces-}build-tick-job"
+  project     = var.project_id
+  region      = var.region
+  description = "Scheduled job to advance the queued Cloud Builds"
+  schedule    = "*/5 * * * *" # Cron expression #(every 5 minutes)
+  time_zone   = "UTC"
+
+  http_target {
+    uri         = "https://${var.region}-${var.project_id}.cloudfunctions.net/${google_cloudfunctions_function.build_function.name}"
+    http_method = "POST"
+    body        = base64encode(jsonencode({ action = "tick" }))
+    oidc_token {
+      service_account_email = google_service_account.scheduler_sa.email
+    }
+    headers = {
+      "Content-type" = "application/json"
+    }
+  }
+}
+
 resource "google_kms_key_ring" "key_ring" {
   name     = "${local.namespaces-}key-ring"
   location = "us"
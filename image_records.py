@@ -0,0 +1,168 @@
+import sys
+from array import array
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the planner falls back to plain loops over the arrays
+    np = None
+
+# Lifecycle states in the order an image moves through them; the index is the state code
+STATE_ORDER = ["READY", "DEPRECATED", "OBSOLETE", "DELETED"]
+STATE_CODES = {state: code for code, state in enumerate(STATE_ORDER)}
+
+
+def parse_epoch(creation_timestamp):
+    """Compute API RFC 3339 timestamp (e.g. 2024-05-01T10:00:00.123-07:00) to epoch seconds."""
+    try:
+        return datetime.fromisoformat(creation_timestamp).timestamp()
+    except ValueError:
+        return datetime.strptime(creation_timestamp, "%Y-%m-%dT%H:%M:%S.%f%z").timestamp()
+
+
+class ImageRecord:
+    """One image as the lifecycle planner needs it: no protobuf, timestamp already parsed."""
+
+    __slots__ = ("name", "family", "state", "ready", "epoch", "label_bits")
+
+    def __init__(self, name, family, state, ready, epoch, label_bits):
+        self.name = name
+        self.family = family
+        self.state = state
+        self.ready = ready
+        self.epoch = epoch
+        self.label_bits = label_bits
+
+
+class ImageTable:
+    """Column-oriented image population: parallel arrays of epoch seconds, state codes and family ids.
+
+    Family names and label `key=value` pairs are interned once; each image's labels are kept as a bitset
+    over the interned pairs. Images whose build status is not READY are kept but never planned.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.epochs = array("d")
+        self.states = array("b")
+        self.ready = array("b")
+        self.family_ids = array("l")
+        self.label_bits = []
+        self.families = []
+        self.family_index = {}
+        self.label_index = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _family_id(self, family):
+        family = sys.intern(family or "")
+        if family not in self.family_index:
+            self.family_index[family] = len(self.families)
+            self.families.append(family)
+        return self.family_index[family]
+
+    def _label_bits(self, labels):
+        bits = 0
+        for key, value in labels.items():
+            pair = sys.intern(f"{key}={value}")
+            if pair not in self.label_index:
+                self.label_index[pair] = len(self.label_index)
+            bits |= 1 << self.label_index[pair]
+        return bits
+
+    def add(self, image):
+        state = image.deprecated.state if image.deprecated else ""
+        self.names.append(image.name)
+        self.epochs.append(parse_epoch(image.creation_timestamp))
+        self.states.append(STATE_CODES.get(state, 0))
+        self.ready.append(0 if image.status and image.status != "READY" else 1)
+        self.family_ids.append(self._family_id(image.family))
+        self.label_bits.append(self._label_bits(dict(image.labels or {})))
+
+    @classmethod
+    def from_images(cls, images):
+        """Build a table from compute_v1.Image objects or anything with the same attributes."""
+        table = cls()
+        for image in images:
+            table.add(image)
+        return table
+
+    def record(self, i):
+        return ImageRecord(self.names[i], self.families[self.family_ids[i]], STATE_ORDER[self.states[i]],
+                           bool(self.ready[i]), self.epochs[i], self.label_bits[i])
+
+    def has_label(self, key, value):
+        """Per-image booleans for a `key=value` label."""
+        bit = self.label_index.get(f"{key}={value}")
+        if bit is None:
+            return [False] * len(self)
+        mask = 1 << bit
+        return [bool(bits & mask) for bits in self.label_bits]
+
+    def newest_ready(self):
+        """Index of the newest READY image of each named family; on equal timestamps the first listed wins."""
+        newest = {}
+        for i in range(len(self)):
+            if not self.ready[i] or self.states[i] != 0 or not self.families[self.family_ids[i]]:
+                continue
+            family_id = self.family_ids[i]
+            if family_id not in newest or self.epochs[i] > self.epochs[newest[family_id]]:
+                newest[family_id] = i
+        return set(newest.values())
+
+    def plan(self, policy, now, keep=()):
+        """Target state code per image for a lifecycle_policy, evaluated over the whole population at once.
+
+        An image only advances through consecutive states whose interval is configured and has elapsed,
+        and the newest READY image of each family plus any image named in `keep` is never deprecated.
+        """
+        now_epoch = now.timestamp()
+        thresholds = {STATE_CODES[state]: now_epoch - days * 86400 for state, days in policy.items() if days is not None}
+        keep = set(keep)
+        protected = self.newest_ready() | {i for i, name in enumerate(self.names) if name in keep}
+        if np is not None and len(self):
+            return self._plan_numpy(thresholds, protected)
+
+        targets = array("b", self.states)
+        for i in range(len(self)):
+            if not self.ready[i]:
+                continue
+            for code in range(self.states[i] + 1, len(STATE_ORDER)):
+                if code not in thresholds or self.epochs[i] >= thresholds[code]:
+                    break
+                if code == STATE_CODES["DEPRECATED"] and i in protected:
+                    break
+                targets[i] = code
+        return targets
+
+    def _plan_numpy(self, thresholds, protected):
+        epochs = np.frombuffer(self.epochs, dtype=np.float64)
+        targets = np.frombuffer(self.states, dtype=np.int8).copy()
+        ready = np.frombuffer(self.ready, dtype=np.int8).astype(bool)
+        movable = ready.copy()
+        movable[list(protected)] = False
+        for code in range(1, len(STATE_ORDER)):
+            if code not in thresholds:
+                # Images already past the gap can still advance; the others stop at code - 1
+                continue
+            advance = ready & (targets == code - 1) & (epochs < thresholds[code])
+            if code == STATE_CODES["DEPRECATED"]:
+                advance &= movable
+            targets[advance] = code
+        return targets
+
+
+def plan_table(table, policy, now=None, keep=()):
+    """Same contract as lifecycle_engine.plan_transitions, computed from an ImageTable."""
+    now = now or datetime.now(timezone.utc)
+    targets = table.plan(policy, now, keep)
+    if np is not None and len(table):
+        changed = np.flatnonzero(targets != np.frombuffer(table.states, dtype=np.int8)).tolist()
+    else:
+        changed = [i for i in range(len(table)) if targets[i] != table.states[i]]
+    plan = []
+    for i in changed:
+        plan.append({"image": table.names[i], "family": table.families[table.family_ids[i]],
+                         "from": STATE_ORDER[table.states[i]], "to": STATE_ORDER[targets[i]]})
+    return plan
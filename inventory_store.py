@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from types import SimpleNamespace
+from datetime import datetime
+from gcp_clients import storage_client, images_client, instances_client
+
+logger = logging.getLogger()
+
+inventory_db_path = os.getenv('INVENTORY_DB_PATH', '/tmp/inventory.db')
+inventory_bucket = os.getenv('INVENTORY_BUCKET')  # When set, the database is shared between jobs through GCS
+inventory_object = os.getenv('INVENTORY_OBJECT', 'inventory/inventory.db')
+inventory_max_age_seconds = int(os.getenv('INVENTORY_MAX_AGE_SECONDS', '3600'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    project TEXT NOT NULL, name TEXT NOT NULL, family TEXT, status TEXT, deprecation_state TEXT,
+    creation_timestamp TEXT, creation_epoch INTEGER, labels TEXT, PRIMARY KEY (project, name));
+CREATE INDEX IF NOT EXISTS images_family ON images (project, family);
+CREATE INDEX IF NOT EXISTS images_state ON images (project, deprecation_state);
+CREATE INDEX IF NOT EXISTS images_created ON images (project, creation_epoch);
+
+CREATE TABLE IF NOT EXISTS instances (
+    project TEXT NOT NULL, zone TEXT NOT NULL, name TEXT NOT NULL, status TEXT, creation_timestamp TEXT,
+    creation_epoch INTEGER, labels TEXT, tags TEXT, disks TEXT, PRIMARY KEY (project, zone, name));
+CREATE INDEX IF NOT EXISTS instances_created ON instances (project, creation_epoch);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    project TEXT NOT NULL, kind TEXT NOT NULL, synced_at REAL, PRIMARY KEY (project, kind));
+"""
+
+
+def to_epoch(creation_timestamp):
+    if not creation_timestamp:
+        return None
+    return int(datetime.strptime(creation_timestamp, "%Y-%m-%dT%H:%M:%S.%f%z").timestamp())
+
+
+class InventoryStore:
+    """Embedded SQLite copy of a project's images and instances, refreshed when it goes stale.
+
+    Each sync does one listing per resource kind and replaces that project's rows in a single
+    transaction; lookups after that are indexed local queries instead of Compute API calls.
+    """
+
+    def __init__(self, path=inventory_db_path, max_age_seconds=inventory_max_age_seconds):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def open_shared(cls):
+        """Open the store, seeding it from the shared GCS copy when INVENTORY_BUCKET is configured."""
+        if inventory_bucket:
+            blob = storage_client().bucket(inventory_bucket).blob(inventory_object)
+            if blob.exists():
+                blob.download_to_filename(inventory_db_path)
+        return cls(inventory_db_path)
+
+    def save_shared(self):
+        if not inventory_bucket:
+            return
+        with self.lock:
+            self.connection.commit()
+            blob = storage_client().bucket(inventory_bucket).blob(inventory_object)
+            blob.upload_from_filename(self.path)
+
+    def is_fresh(self, project, kind):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT synced_at FROM sync_state WHERE project = ? AND kind = ?", (project, kind)).fetchone()
+        return bool(row) and time.time() - row["synced_at"] < self.max_age_seconds
+
+    def _replace(self, project, kind, insert_sql, rows):
+        with self.lock, self.connection:
+            self.connection.execute(f"DELETE FROM {kind} WHERE project = ?", (project,))
+            self.connection.executemany(insert_sql, rows)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sync_state (project, kind, synced_at) VALUES (?, ?, ?)",
+                (project, kind, time.time()))
+        logger.info(f"Inventory synced {len(rows)} {kind} for project {project}")
+
+    def sync_images(self, project, force=False):
+        if not force and self.is_fresh(project, "images"):
+            return
+        from google.cloud import compute_v1
+        rows = []
+        for image in images_client().list(request=compute_v1.ListImagesRequest(project=project, max_results=500)):
+            state = image.deprecated.state if image.deprecated else ""
+            rows.append((project, image.name, image.family, image.status, state, image.creation_timestamp,
+                         to_epoch(image.creation_timestamp), json.dumps(dict(image.labels))))
+        self._replace(project, "images", "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def sync_instances(self, project, force=False):
+        if not force and self.is_fresh(project, "instances"):
+            return
+        from google.cloud import compute_v1
+        rows = []
+        request = compute_v1.AggregatedListInstancesRequest(project=project, max_results=500)
+        for zone, scoped_list in instances_client().aggregated_list(request=request):
+            for instance in scoped_list.instances:
+                rows.append((project, zone.split('/')[-1], instance.name, instance.status, instance.creation_timestamp,
+                             to_epoch(instance.creation_timestamp), json.dumps(dict(instance.labels)),
+                             json.dumps(list(instance.tags.items)), json.dumps([disk.source for disk in instance.disks])))
+        self._replace(project, "instances", "INSERT INTO instances VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params).fetchall()]
+
+    def images(self, project, families=None, deprecation_state=None, created_before=None):
+        """Image rows for a project, narrowed by family, deprecation state and creation epoch."""
+        sql, params = "SELECT * FROM images WHERE project = ?", [project]
+        if families:
+            sql += f" AND family IN ({','.join('?' * len(families))})"
+            params.extend(families)
+        if deprecation_state is not None:
+            sql += " AND deprecation_state = ?"
+            params.append(deprecation_state)
+        if created_before is not None:
+            sql += " AND creation_epoch < ?"
+            params.append(created_before)
+        return self.query(sql, params)
+
+    def instances(self, project, zone=None, created_before=None):
+        sql, params = "SELECT * FROM instances WHERE project = ?", [project]
+        if zone:
+            sql += " AND zone = ?"
+            params.append(zone)
+        if created_before is not None:
+            sql += " AND creation_epoch < ?"
+            params.append(created_before)
+        return self.query(sql, params)
+
+    def record_image_state(self, project, image_name, state):
+        """Keep the local copy in step after this job changes an image, so later queries see it."""
+        with self.lock, self.connection:
+            if state == "DELETED":
+                self.connection.execute("DELETE FROM images WHERE project = ? AND name = ?", (project, image_name))
+            else:
+                self.connection.execute("UPDATE images SET deprecation_state = ? WHERE project = ? AND name = ?",
+                                        (state, project, image_name))
+
+    def forget_instance(self, project, zone, instance_name):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM instances WHERE project = ? AND zone = ? AND name = ?",
+                                    (project, zone, instance_name))
+
+
+def image_view(row):
+    """Expose an images row with the attributes lifecycle_engine reads from a compute_v1.Image."""
+    return SimpleNamespace(name=row["name"], family=row["family"] or "", status=row["status"],
+                           creation_timestamp=row["creation_timestamp"],
+                           labels=json.loads(row["labels"] or "{}"),
+                           deprecated=SimpleNamespace(state=row["deprecation_state"] or ""))
+
+
+def instance_view(row):
+    """Expose an instances row with the attributes the cleanup jobs read from a compute_v1.Instance."""
+    return SimpleNamespace(name=row["name"], zone=row["zone"], status=row["status"],
+                           creation_timestamp=row["creation_timestamp"],
+                           labels=json.loads(row["labels"] or "{}"),
+                           tags=SimpleNamespace(items=json.loads(row["tags"] or "[]")),
+                           disks=[SimpleNamespace(source=source) for source in json.loads(row["disks"] or "[]")])
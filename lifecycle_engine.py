@@ -0,0 +1,180 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from inventory_store import image_view
+from image_records import STATE_ORDER, ImageTable, plan_table
+
+logger = logging.getLogger()
+
+delete_max_in_flight = int(os.getenv('DELETE_MAX_IN_FLIGHT', '10'))  # Image deletes running at once
+delete_poll_seconds = int(os.getenv('DELETE_POLL_SECONDS', '5'))
+project_workers = int(os.getenv('LIFECYCLE_PROJECT_WORKERS', '4'))  # Projects swept at once
+
+def lifecycle_policy(deprecate_days=None, obsolete_days=None, delete_days=None):
+    """Age in days (from image creation) at which each transition is due; None disables that transition."""
+    return {"DEPRECATED": deprecate_days, "OBSOLETE": obsolete_days, "DELETED": delete_days}
+
+
+def image_state(image):
+    state = image.deprecated.state if image.deprecated else ""
+    return state if state in STATE_ORDER else "READY"
+
+
+def list_images(client, project_id, filter_str=None):
+    """List a project's images once, following every page."""
+    from google.cloud import compute_v1
+    request = compute_v1.ListImagesRequest(project=project_id, filter=filter_str, max_results=300)
+    return list(client.list(request=request))
+
+
+def family_filter(families):
+    return " OR ".join(f'(family = "{family}")' for family in families)
+
+
+def list_images_by_family(client, project_id, families, inventory=None):
+    """List every image of the given families in one paged sweep and partition them by family in memory.
+
+    With an inventory store the images come from its indexed local copy, refreshed only when stale.
+    """
+    partitions = {family: [] for family in families}
+    if inventory:
+        inventory.sync_images(project_id)
+        images = [image_view(row) for row in inventory.images(project_id, families)]
+    else:
+        images = list_images(client, project_id, family_filter(families))
+    for image in images:
+        partitions.setdefault(image.family, []).append(image)
+    return partitions
+
+
+def plan_transitions(images, policy, now=None, keep=()):
+    """Work out the lifecycle transition of every image from a single listing.
+
+    An image only advances through consecutive states whose interval is configured and has elapsed,
+    so a READY image is never deleted by a policy that only sets delete_days. The newest READY image
+    of each family and any image named in `keep` stay READY.
+    Returns a list of {"image", "family", "from", "to"} entries, one per image that needs to change.
+    Timestamps are parsed once into an ImageTable and the policy is evaluated over it as a whole.
+    """
+    return plan_table(ImageTable.from_images(images), policy, now, keep)
+
+
+def passes_obsolete(transition):
+    obsolete = STATE_ORDER.index("OBSOLETE")
+    return STATE_ORDER.index(transition["from"]) < obsolete <= STATE_ORDER.index(transition["to"])
+
+
+def delete_images(client, project_id, transitions, max_in_flight=delete_max_in_flight, poll_seconds=delete_poll_seconds):
+    """Delete images with at most `max_in_flight` global operations pending, polling them together.
+
+    Returns one outcome per transition; a failed delete is recorded and the rest carry on.
+    """
+    queue = list(transitions)
+    pending = []
+    outcomes = []
+    while queue or pending:
+        while queue and len(pending) < max_in_flight:
+            transition = queue.pop(0)
+            try:
+                pending.append((transition, client.delete(project=project_id, image=transition["image"])))
+                logger.info(f"Delete submitted for image {transition['image']}.")
+            except Exception as e:
+                logger.error(f"Failed to submit delete for image {transition['image']}: {e}")
+                outcomes.append(dict(transition, status="error", error=str(e)))
+
+        still_pending = []
+        for transition, operation in pending:
+            try:
+                if not operation.done():
+                    still_pending.append((transition, operation))
+                    continue
+                operation.result()
+                logger.info(f"Deleted image {transition['image']}.")
+                outcomes.append(dict(transition, status="ok", error=None))
+            except Exception as e:
+                logger.error(f"Failed to delete image {transition['image']}: {e}")
+                outcomes.append(dict(transition, status="error", error=str(e)))
+        # Only wait when no operation finished this round, otherwise refill the freed slots first
+        if still_pending and len(still_pending) == len(pending):
+            time.sleep(poll_seconds)
+        pending = still_pending
+    return outcomes
+
+
+def execute_plan(client, project_id, plan, on_obsolete=None):
+    """Carry out a plan, returning one outcome per image. A failed image does not stop the rest.
+
+    State changes are applied in order; deletions go through delete_images concurrently.
+    `on_obsolete(image_name)` runs for every image that reaches or passes OBSOLETE in this pass.
+    """
+    from google.cloud import compute_v1
+    outcomes = []
+    for transition in plan:
+        if transition["to"] == "DELETED":
+            continue
+        outcome = dict(transition, status="ok", error=None)
+        try:
+            status = compute_v1.DeprecationStatus(state=transition["to"])
+            client.deprecate(project=project_id, image=transition["image"], deprecation_status_resource=status)
+            logger.info(f"Moved image {transition['image']} from {transition['from']} to {transition['to']}.")
+        except Exception as e:
+            logger.error(f"Failed to move image {transition['image']} to {transition['to']}: {e}")
+            outcome.update(status="error", error=str(e))
+        outcomes.append(outcome)
+
+    outcomes.extend(delete_images(client, project_id, [t for t in plan if t["to"] == "DELETED"]))
+    if on_obsolete:
+        for outcome in outcomes:
+            if outcome["status"] == "ok" and passes_obsolete(outcome):
+                on_obsolete(outcome["image"])
+    return outcomes
+
+
+def run_lifecycle(client, project_id, policy, filter_str=None, keep=(), on_obsolete=None):
+    """List once, plan every transition, then execute the plan."""
+    images = list_images(client, project_id, filter_str)
+    plan = plan_transitions(images, policy, keep=keep)
+    logger.info(f"Lifecycle plan for {project_id}: {len(plan)} transitions across {len(images)} images")
+    return execute_plan(client, project_id, plan, on_obsolete)
+
+
+def run_family_lifecycle(client, project_id, families, policy, keep=(), on_obsolete=None, inventory=None):
+    """Sweep a project once for all families, plan each family's partition, then execute the combined plan."""
+    partitions = list_images_by_family(client, project_id, families, inventory)
+    plan = []
+    for family, images in partitions.items():
+        plan.extend(plan_transitions(images, policy, keep=keep))
+        logger.info(f"Lifecycle plan for {project_id} family {family}: {len(images)} images")
+    logger.info(f"Lifecycle plan for {project_id}: {len(plan)} transitions across {len(partitions)} families")
+    outcomes = execute_plan(client, project_id, plan, on_obsolete)
+    if inventory:
+        for outcome in outcomes:
+            if outcome["status"] == "ok":
+                inventory.record_image_state(project_id, outcome["image"], outcome["to"])
+    return outcomes
+
+
+def run_lifecycle_across_projects(client, project_ids, families, policy, keep=(), on_obsolete=None,
+                                  workers=project_workers, inventory=None):
+    """Run run_family_lifecycle for several projects in parallel and return their outcomes as one list.
+
+    A project whose sweep fails outright contributes a single error outcome instead of stopping the others.
+    """
+    def sweep(project_id):
+        try:
+            return run_family_lifecycle(client, project_id, families, policy, keep, on_obsolete, inventory)
+        except Exception as e:
+            logger.error(f"Lifecycle sweep failed for project {project_id}: {e}")
+            return [{"image": f"{project_id}/*", "family": None, "from": None, "to": None, "status": "error", "error": str(e)}]
+
+    outcomes = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(project_ids)))) as executor:
+        for project_outcomes in executor.map(sweep, project_ids):
+            outcomes.extend(project_outcomes)
+    return outcomes
+
+
+def summarize(outcomes):
+    failed = [outcome for outcome in outcomes if outcome["status"] != "ok"]
+    return {"transitions": len(outcomes), "failed": len(failed), "errors": {o["image"]: o["error"] for o in failed}}
@@ -1,13 +1,14 @@
 import datetime
-from google.cloud import compute_v1
+from gcp_clients import images_client, log_stats as log_client_stats, snapshot_stats as snapshot_client_stats
+from disk_sweeper import sweep_orphans
+from vm_cleanup import list_instances_all_zones, stale_instance_filter, is_protected, is_older_than, delete_instances_by_zone
 
 def lifecycle_handler(request):
+    from google.cloud import compute_v1
+    client_stats = snapshot_client_stats()
     # Initialize clients
-    image_client = compute_v1.ImagesClient()
-    instance_client = compute_v1.InstancesClient()
-    disk_client = compute_v1.DisksClient()
+    image_client = images_client()
     project_id = "consumer-project-431315"
-    zone = "us-east1-b"
     now = datetime.datetime.now(datetime.timezone.utc)
     
     # Define lifecycle durations
@@ -42,22 +43,23 @@ def lifecycle_handler(request):
                 )
             )
     
-    # Step 2: Clean Up Old VMs
-    for instance in instance_client.list(project=project_id, zone=zone):
-        creation_time = instance.creation_timestamp
-        creation_date = datetime.datetime.strptime(creation_time, '%Y-%m-%dT%H:%M:%S.%f%z')
-        age_in_days = (now - creation_date).days
-
-        if age_in_days > vm_delete_after_days and "golden-vm" in instance.tags.items:
-            # Delete old VMs
-            print(f"Deleting old VM: {instance.name}")
-            instance_client.delete(project=project_id, zone=zone, instance=instance.name)
+    # Step 2: Clean Up Old VMs in every zone
+    # One filtered aggregated listing; deletes run per zone in parallel and are waited on,
+    # so auto-delete boot disks are gone with their VM
+    cutoff_date = now - datetime.timedelta(days=vm_delete_after_days)
+    stale = []
+    for instance_zone, instance in list_instances_all_zones(
+            project_id, stale_instance_filter(vm_delete_after_days, 'tags.items = "golden-vm"')):
+        if "golden-vm" in instance.tags.items and not is_protected(instance) and is_older_than(instance, cutoff_date):
+            print(f"Deleting old VM: {instance.name} in zone {instance_zone}")
+            stale.append((instance_zone, instance.name))
+    for key, error in delete_instances_by_zone(project_id, stale).items():
+        if error:
+            print(f"Failed to delete VM {key}: {error}")
 
-            # Optionally, clean up disks attached to the VM
-            for disk in instance.disks:
-                if disk.boot and disk.auto_delete:
-                    print(f"Deleting associated boot disk: {disk.source}")
-                    disk_name = disk.source.split('/')[-1]
-                    disk_client.delete(project=project_id, zone=zone, disk=disk_name)
+    # Step 3: Reclaim disks and snapshots left behind by failed builds and scan VMs
+    sweep = sweep_orphans(project_id)
+    print(f"Orphan sweep: {sweep['orphans']} orphans, {sweep['failed']} failed, dry run {sweep['dry_run']}")
 
+    log_client_stats(client_stats)
     return "Image and VM cleanup completed."
@@ -0,0 +1,116 @@
+import os
+import time
+import logging
+import threading
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from secret_provider import get_secret_gcp
+
+logger = logging.getLogger()
+
+image_table = os.getenv('dynamodb_table')
+dynamodb_region = os.getenv('DYNAMODB_REGION', 'us-east-1')
+# Points the client at DynamoDB Local or a moto server instead of AWS, e.g. http://localhost:8000
+dynamodb_endpoint_url = os.getenv('DYNAMODB_ENDPOINT_URL')
+# TransactWriteItems accepts at most 100 actions per call
+TRANSACT_BATCH_SIZE = 100
+MAX_ATTEMPTS = 3
+retry_base_seconds = float(os.getenv('DYNAMODB_RETRY_BASE_SECONDS', '0.2'))  # Doubled after each failed attempt
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_dynamodb_client(project=None):
+    """Return the process-wide DynamoDB client, fetching the AWS keys from Secret Manager on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            aws_access_key = get_secret_gcp(os.getenv('aws_access_key', "aws-access-key"), project)
+            aws_secret_key = get_secret_gcp(os.getenv('aws_secret_key', "aws-secret-key"), project)
+            _client = boto3.client('dynamodb', region_name=dynamodb_region, endpoint_url=dynamodb_endpoint_url
+            , aws_access_key_id=aws_access_key, aws_secret_access_key=aws_secret_key
+            , config=Config(max_pool_connections=25, retries={'mode': 'adaptive'}))
+    return _client
+
+
+class MetadataWriter:
+    """Buffers image status transitions and writes them as conditional TransactWriteItems batches.
+
+    The condition skips items that already have the target status (so repeat runs do not rewrite them)
+    and items that do not exist (so a missing image is never created as a bare record).
+    """
+
+    def __init__(self, db_client=None, table=None):
+        self.db_client = db_client or get_dynamodb_client()
+        self.table = table or image_table
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stats = {"updated": 0, "skipped": 0, "failed": 0}
+
+    def set_active(self, image_name, active):
+        with self.lock:
+            self.pending.append((image_name, 'true' if active else 'false'))
+
+    def deactivate(self, image_name):
+        self.set_active(image_name, False)
+
+    def _action(self, image_name, active):
+        return {'Update': {
+            'TableName': self.table,
+            'Key': {'csp': {'S': 'gcp'}, 'image_name': {'S': image_name}},
+            'UpdateExpression': 'SET active = :active',
+            'ConditionExpression': 'attribute_exists(image_name) AND active <> :active',
+            'ExpressionAttributeValues': {':active': {'S': active}},
+        }}
+
+    @staticmethod
+    def _backoff(attempt):
+        if attempt < MAX_ATTEMPTS:
+            time.sleep(retry_base_seconds * 2 ** (attempt - 1))
+
+    def _write_batch(self, batch):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                self.db_client.transact_write_items(TransactItems=[self._action(*item) for item in batch])
+                self.stats["updated"] += len(batch)
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    if attempt == MAX_ATTEMPTS:
+                        logger.error(f"Failed to write {len(batch)} metadata updates: {e}")
+                        self.stats["failed"] += len(batch)
+                        return
+                    self._backoff(attempt)
+                    continue
+                # A single failed condition cancels the whole transaction; drop those items and retry the rest
+                reasons = e.response.get('CancellationReasons')
+                if not reasons:
+                    self._backoff(attempt)
+                    continue
+                retry = []
+                for item, reason in zip(batch, reasons):
+                    if reason.get('Code') == 'ConditionalCheckFailed':
+                        self.stats["skipped"] += 1
+                    else:
+                        retry.append(item)
+                batch = retry
+                if not batch:
+                    return
+                # Items cancelled only because of others ("None") can go again at once; conflicts and throttling wait
+                if any(reason.get('Code') not in ('ConditionalCheckFailed', 'None') for reason in reasons):
+                    self._backoff(attempt)
+        logger.error(f"Giving up on {len(batch)} metadata updates after {MAX_ATTEMPTS} attempts")
+        self.stats["failed"] += len(batch)
+
+    def flush(self):
+        """Write every buffered transition and return the running counts."""
+        with self.lock:
+            # A transaction may touch each item only once, so keep the latest status per image
+            pending = list(dict(self.pending).items())
+            self.pending = []
+        for i in range(0, len(pending), TRANSACT_BATCH_SIZE):
+            self._write_batch(pending[i:i + TRANSACT_BATCH_SIZE])
+        logger.info({'action': 'metadata-flush', **self.stats})
+        return dict(self.stats)
@@ -1,61 +1,109 @@
-from google.cloud import compute_v1, storage
+import os
+import json
 import datetime
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from dateutil import parser  # Importing dateutil for parsing timestamps
+from gcp_clients import images_client, storage_client as get_storage_client
+
+project_id = os.getenv('PROJECT_ID', "your-project-id")  # Replace with your GCP project ID
+bucket_name = os.getenv('EXPORT_BUCKET', "your-bucket-name")  # Replace with your Cloud Storage bucket name
+storage_class = os.getenv('EXPORT_STORAGE_CLASS', "COLDLINE")  # Options: STANDARD, NEARLINE, COLDLINE, ARCHIVE
+threshold_days = int(os.getenv('EXPORT_THRESHOLD_DAYS', '5'))  # 5 days ago for testing
+export_workers = int(os.getenv('EXPORT_WORKERS', '4'))  # Exports running at once
+journal_blob_name = os.getenv('EXPORT_JOURNAL', 'image-exports/journal.json')
+
+
+class ExportJournal:
+    """Per-image export progress kept in the bucket, so an interrupted run resumes where it stopped.
+
+    States: "exported" (archive written, image not yet deleted), "done" (image deleted) and "failed".
+    """
+
+    def __init__(self, bucket):
+        self.blob = bucket.blob(journal_blob_name)
+        self.lock = threading.Lock()
+        self.entries = json.loads(self.blob.download_as_text()) if self.blob.exists() else {}
+
+    def state(self, image_name):
+        with self.lock:
+            return self.entries.get(image_name, {}).get("state")
+
+    def record(self, image_name, state, error=None):
+        with self.lock:
+            self.entries[image_name] = {"state": state, "error": error,
+                                        "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+            content = json.dumps(self.entries)
+            # Written under the lock so an older snapshot never overwrites a newer one
+            self.blob.upload_from_string(content, content_type='application/json')
+
+
+def export_image(image_name, destination_uri):
+    print(f"Exporting image {image_name} to {destination_uri}...")
+    subprocess.run([
+        "gcloud", "compute", "images", "export",
+        f"--destination-uri={destination_uri}",
+        f"--image={image_name}",
+        f"--project={project_id}"
+    ], check=True)
+    print(f"Export successful for image: {image_name}")
+
 
 def move_images_to_storage():
-    project_id = "your-project-id"  # Replace with your GCP project ID
-    bucket_name = "your-bucket-name"  # Replace with your Cloud Storage bucket name
-    storage_class = "COLDLINE"  # Options: STANDARD, NEARLINE, COLDLINE, ARCHIVE
-    client = compute_v1.ImagesClient()
-    storage_client = storage.Client()
-
-    # Calculate the threshold date (5 days ago for testing)
-    threshold_days = 5
+    client = images_client()
+    storage_client = get_storage_client()
+    bucket = storage_client.get_bucket(bucket_name)
+
     today = datetime.datetime.now(datetime.timezone.utc)
     threshold_date = today - datetime.timedelta(days=threshold_days)
-
     print(f"Threshold date: {threshold_date}")
 
-    # List all custom images in the project
+    # gcloud export has no storage class option, so objects take the bucket default when written.
+    # Only fall back to rewriting each object when the bucket default differs.
+    rewrite_storage_class = bucket.storage_class != storage_class
+    if rewrite_storage_class:
+        print(f"Bucket default storage class is {bucket.storage_class}; exported objects will be rewritten to {storage_class}")
+
+    # One listing of the bucket is the index of archives that already exist
+    exported = {blob.name for blob in storage_client.list_blobs(bucket_name)}
+    journal = ExportJournal(bucket)
+
     print("Fetching images...")
-    images = client.list(project=project_id)
-    for image in images:
-        # Parse the creation timestamp using dateutil.parser
-        creation_time = parser.parse(image.creation_timestamp)
-
-        # Check if the image is older than 5 days
-        if creation_time < threshold_date:
-            print(f"Processing image: {image.name} (Created on: {creation_time})")
-            
-            # Define the destination URI in Cloud Storage
-            destination_uri = f"gs://{bucket_name}/{image.name}.tar.gz"
-
-            try:
-                # Export the image to Cloud Storage using gcloud CLI
-                print(f"Exporting image {image.name} to {destination_uri}...")
-                subprocess.run([
-                    "gcloud", "compute", "images", "export",
-                    f"--destination-uri={destination_uri}",
-                    f"--image={image.name}",
-                    f"--project={project_id}"
-                ], check=True)
-
-                print(f"Export successful for image: {image.name}")
-
-                # Set the storage class of the uploaded file (optional)
-                print(f"Updating storage class of {image.name}.tar.gz to {storage_class}...")
-                bucket = storage_client.bucket(bucket_name)
-                blob = bucket.blob(f"{image.name}.tar.gz")
-                blob.update_storage_class(storage_class)
-
-                # Delete the image from Compute Engine after export
-                print(f"Deleting image: {image.name}")
-                client.delete(project=project_id, image=image.name)
-            except Exception as e:
-                print(f"Error processing image {image.name}: {e}")
-
-    print("All old images have been processed.")
+    candidates = [image for image in client.list(project=project_id)
+                  if parser.parse(image.creation_timestamp) < threshold_date]
+    print(f"{len(candidates)} images older than {threshold_days} days")
+
+    def process(image):
+        object_name = f"{image.name}.tar.gz"
+        try:
+            if journal.state(image.name) == "done":
+                return image.name, "done"
+            if object_name in exported:
+                print(f"Archive for {image.name} already exists, skipping export")
+            else:
+                print(f"Processing image: {image.name} (Created on: {image.creation_timestamp})")
+                export_image(image.name, f"gs://{bucket_name}/{object_name}")
+                if rewrite_storage_class:
+                    bucket.blob(object_name).update_storage_class(storage_class)
+            journal.record(image.name, "exported")
+
+            # Delete the image from Compute Engine after export and wait for it
+            print(f"Deleting image: {image.name}")
+            client.delete(project=project_id, image=image.name).result()
+            journal.record(image.name, "done")
+            return image.name, "done"
+        except Exception as e:
+            print(f"Error processing image {image.name}: {e}")
+            journal.record(image.name, "failed", str(e))
+            return image.name, f"failed: {e}"
+
+    with ThreadPoolExecutor(max_workers=max(1, export_workers)) as executor:
+        results = dict(executor.map(process, candidates))
+
+    failed = {name: result for name, result in results.items() if result != "done"}
+    print(f"All old images have been processed: {len(results) - len(failed)} moved, {len(failed)} failed.")
+    return results
 
 # Run the function
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+import json
+import hashlib
+import threading
+from loguru import logger
+from gcp_clients import storage_client
+
+
+def project_fingerprint(instances):
+    """Cheap change marker for a project: VM count, newest VM creation time and a hash of names, labels and disks."""
+    digest = hashlib.sha256()
+    max_creation_time = ""
+    for zone, instance in sorted(instances, key=lambda item: (item[0], item[1].name)):
+        max_creation_time = max(max_creation_time, instance.creation_timestamp)
+        digest.update(json.dumps([
+            zone,
+            instance.name,
+            sorted(dict(instance.labels).items()),
+            sorted(disk.source for disk in instance.disks),
+        ]).encode("UTF-8"))
+    return f"{len(instances)}:{max_creation_time}:{digest.hexdigest()}"
+
+
+class ProjectSnapshotStore:
+    """Per-project scan rows and fingerprints from previous runs, kept as JSON objects in GCS."""
+
+    def __init__(self, bucket_name, prefix):
+        self.bucket = storage_client().bucket(bucket_name)
+        self.prefix = prefix.rstrip('/')
+        self.lock = threading.Lock()
+        self.fingerprints = self._load_fingerprints()
+        # Without a previous run every VM would look new, so the first run produces no delta
+        self.has_baseline = bool(self.fingerprints)
+
+    def _fingerprints_blob(self):
+        return self.bucket.blob(f"{self.prefix}/fingerprints.json")
+
+    def _rows_blob(self, project):
+        return self.bucket.blob(f"{self.prefix}/projects/{project}.json")
+
+    def _load_fingerprints(self):
+        blob = self._fingerprints_blob()
+        if not blob.exists():
+            logger.info("No previous adoption snapshot found, scanning every project")
+            return {}
+        return json.loads(blob.download_as_text())
+
+    def is_unchanged(self, project, fingerprint):
+        with self.lock:
+            return self.fingerprints.get(project) == fingerprint
+
+    def read_rows(self, project):
+        """Return the stored rows for a project, or None if there is no snapshot for it."""
+        blob = self._rows_blob(project)
+        if not blob.exists():
+            return None
+        return json.loads(blob.download_as_text())
+
+    def write_rows(self, project, rows, fingerprint):
+        self._rows_blob(project).upload_from_string(json.dumps(rows), content_type='application/json')
+        with self.lock:
+            self.fingerprints[project] = fingerprint
+
+    def save(self):
+        with self.lock:
+            content = json.dumps(self.fingerprints)
+        self._fingerprints_blob().upload_from_string(content, content_type='application/json')
+
+
+def vm_compliance(rows):
+    """Collapse disk-level rows into one status per VM: compliant only if every disk is."""
+    statuses = {}
+    for row in rows:
+        key = (row["Project"], row["VM Zone"], row["VM Name"])
+        if statuses.get(key) != "NON_COMPLIANT":
+            statuses[key] = row["Compliant Status"]
+    return statuses
+
+
+def compliance_delta(previous_rows, current_rows):
+    """Return rows for VMs whose compliance changed since the previous snapshot, including new VMs."""
+    previous = vm_compliance(previous_rows or [])
+    delta = []
+    for (project, zone, vm_name), status in vm_compliance(current_rows).items():
+        previous_status = previous.get((project, zone, vm_name))
+        if previous_status == status:
+            continue
+        delta.append({
+            "Project": project,
+            "VM Name": vm_name,
+            "VM Zone": zone,
+            "Previous Status": previous_status,
+            "Compliant Status": status,
+            "Change": "NEWLY_COMPLIANT" if status == "COMPLIANT" else "NEWLY_NON_COMPLIANT",
+        })
+    return delta
@@ -0,0 +1,96 @@
+import csv
+import gzip
+from loguru import logger
+from gcp_clients import storage_client
+
+# Resumable uploads are sent in chunks of this size (must be a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class CsvGzipReportWriter:
+    extension = 'csv.gz'
+    content_type = 'application/gzip'
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.row_count = 0
+        self.file = gzip.open(path, 'wt', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+        self.row_count += len(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class XlsxReportWriter:
+    extension = 'xlsx'
+    content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    def __init__(self, path, columns):
+        from openpyxl import Workbook
+        self.path = path
+        self.columns = columns
+        self.row_count = 0
+        # Write-only workbooks stream rows to disk instead of keeping cell objects in memory
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.append(columns)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.sheet.append([row.get(column) for column in self.columns])
+        self.row_count += len(rows)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class ParquetReportWriter:
+    extension = 'parquet'
+    content_type = 'application/vnd.apache.parquet'
+
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.path = path
+        self.columns = columns
+        self.row_count = 0
+        self.schema = pa.schema([(column, pa.string()) for column in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='snappy')
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+        data = {column: [None if row.get(column) is None else str(row.get(column)) for row in rows]
+                for column in self.columns}
+        self.writer.write_table(self.pa.Table.from_pydict(data, schema=self.schema))
+        self.row_count += len(rows)
+
+    def close(self):
+        self.writer.close()
+
+
+REPORT_WRITERS = {
+    'csv.gz': CsvGzipReportWriter,
+    'xlsx': XlsxReportWriter,
+    'parquet': ParquetReportWriter,
+}
+
+
+def open_report_writer(report_format, path, columns):
+    """Return a writer that appends row batches to `path` in the requested format."""
+    if report_format not in REPORT_WRITERS:
+        raise ValueError(f"Unsupported report format {report_format}, expected one of {list(REPORT_WRITERS)}")
+    return REPORT_WRITERS[report_format](path, columns)
+
+
+def upload_report(bucket_name, destination_blob_name, path, content_type):
+    """Upload a finished report file to GCS as a chunked resumable upload."""
+    blob = storage_client().bucket(bucket_name).blob(destination_blob_name, chunk_size=UPLOAD_CHUNK_SIZE)
+    blob.upload_from_filename(path, content_type=content_type)
+    logger.info(f"File uploaded to gs://{bucket_name}/{destination_blob_name}")
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import threading
+from loguru import logger
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from gcp_clients import storage_client
+
+checkpoint_max_age_hours = float(os.getenv('CHECKPOINT_MAX_AGE_HOURS', '12'))  # Unfinished runs older than this are not resumed
+RUN_ID_FORMAT = "%Y-%m-%dT%H%M%S"
+
+
+class RunCheckpoint:
+    """Durable per-project results and a manifest for one adoption run, so a restarted run can resume.
+
+    `{prefix}/current.json` points at the active run. While its status is "running" and it started less than
+    `max_resume_hours` ago, a new invocation resumes that run: projects with a checkpoint object are skipped,
+    failed and pending ones are scanned again. An older unfinished run is abandoned and a fresh one started.
+    """
+
+    def __init__(self, bucket_name, prefix, flush_seconds=30, max_resume_hours=checkpoint_max_age_hours):
+        self.bucket = storage_client().bucket(bucket_name)
+        self.prefix = prefix.rstrip('/')
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.failed, self.pending = set(), set()
+        self.last_flush = time.monotonic()
+
+        current = self._read_json(f"{self.prefix}/current.json")
+        if current and current.get("status") == "running" and self._age_hours(current["run_id"]) < max_resume_hours:
+            self.run_id = current["run_id"]
+            self.completed = self._list_completed()
+            logger.info(f"Resuming adoption run {self.run_id} with {len(self.completed)} projects already completed")
+        else:
+            if current and current.get("status") == "running":
+                logger.warning(f"Abandoning unfinished adoption run {current['run_id']}, it is older than {max_resume_hours} hours")
+            self.run_id = datetime.now(timezone.utc).strftime(RUN_ID_FORMAT)
+            self.completed = set()
+            logger.info(f"Starting adoption run {self.run_id}")
+        self._write_json(f"{self.prefix}/current.json", {"run_id": self.run_id, "status": "running"})
+
+    @staticmethod
+    def _age_hours(run_id):
+        started = datetime.strptime(run_id, RUN_ID_FORMAT).replace(tzinfo=timezone.utc)
+        return (datetime.now(timezone.utc) - started).total_seconds() / 3600
+
+    def _read_json(self, name):
+        blob = self.bucket.blob(name)
+        if not blob.exists():
+            return None
+        return json.loads(blob.download_as_text())
+
+    def _write_json(self, name, content):
+        self.bucket.blob(name).upload_from_string(json.dumps(content), content_type='application/json')
+
+    def _project_prefix(self):
+        return f"{self.prefix}/{self.run_id}/projects/"
+
+    def _list_completed(self):
+        prefix = self._project_prefix()
+        return {blob.name[len(prefix):-len(".json")] for blob in self.bucket.list_blobs(prefix=prefix)}
+
+    def remaining(self, projects):
+        """Filter a project stream down to the projects this run has not completed yet."""
+        for project in projects:
+            if project in self.completed:
+                continue
+            with self.lock:
+                self.pending.add(project)
+            yield project
+
+    def complete(self, project, rows, delta):
+        self._write_json(f"{self._project_prefix()}{project}.json", {"rows": rows, "delta": delta})
+        with self.lock:
+            self.completed.add(project)
+            self.pending.discard(project)
+            self.failed.discard(project)
+
+    def fail(self, project):
+        with self.lock:
+            self.failed.add(project)
+            self.pending.discard(project)
+
+    def flush(self, status="running"):
+        with self.lock:
+            manifest = {
+                "run_id": self.run_id,
+                "status": status,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "completed_count": len(self.completed),
+                "failed": sorted(self.failed),
+                "pending": sorted(self.pending),
+            }
+        self._write_json(f"{self.prefix}/{self.run_id}/manifest.json", manifest)
+        self.last_flush = time.monotonic()
+
+    def maybe_flush(self):
+        """Write the manifest if flush_seconds have passed since the last write. Returns True if it wrote."""
+        if time.monotonic() - self.last_flush < self.flush_seconds:
+            return False
+        self.flush()
+        return True
+
+    def iter_results(self, workers=8):
+        """Yield (project, rows, delta) from every checkpoint of this run, downloading with `workers` threads."""
+        blobs = sorted(self.bucket.list_blobs(prefix=self._project_prefix()), key=lambda blob: blob.name)
+
+        def load(blob):
+            content = json.loads(blob.download_as_text())
+            return blob.name.split('/')[-1][:-len(".json")], content["rows"], content["delta"]
+
+        # Download a bounded window at a time so finished downloads never pile up in memory
+        window = workers * 4
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i in range(0, len(blobs), window):
+                yield from executor.map(load, blobs[i:i + window])
+
+    def finish(self):
+        self.flush(status="done")
+        self._write_json(f"{self.prefix}/current.json", {"run_id": self.run_id, "status": "done"})
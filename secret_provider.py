@@ -0,0 +1,84 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+project_id = os.getenv('PROJECT_ID')  # Google Cloud Project ID
+secret_ttl_seconds = int(os.getenv('SECRET_TTL_SECONDS', '300'))
+
+_client = None
+_cache = {}
+_lock = threading.Lock()
+stats = {"hits": 0, "misses": 0, "fetch_seconds": 0.0}
+
+
+def get_client():
+    """Return the process-wide Secret Manager client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from gcp_clients import secret_manager_client
+                _client = secret_manager_client()
+    return _client
+
+
+def get_secret_gcp(secret_id, project=None):
+    """Return the latest version of a secret, served from the in-process cache while it is fresh."""
+    project = project or project_id
+    key = (project, secret_id)
+    with _lock:
+        entry = _cache.get(key)
+        if entry and time.monotonic() < entry[1]:
+            stats["hits"] += 1
+            return entry[0]
+        stats["misses"] += 1
+    started = time.monotonic()
+    name = f"projects/{project}/secrets/{secret_id}/versions/latest"
+    response = get_client().access_secret_version(request={"name": name})
+    value = response.payload.data.decode("UTF-8")
+    finished = time.monotonic()
+    with _lock:
+        stats["fetch_seconds"] += finished - started
+        _cache[key] = (value, finished + secret_ttl_seconds)
+    return value
+
+
+def prefetch_secrets(secret_ids, project=None):
+    """Fetch a named set of secrets concurrently so later lookups are cache hits."""
+    secret_ids = [secret_id for secret_id in set(secret_ids) if secret_id]
+    if not secret_ids:
+        return
+    with ThreadPoolExecutor(max_workers=len(secret_ids)) as executor:
+        futures = {executor.submit(get_secret_gcp, secret_id, project): secret_id for secret_id in secret_ids}
+        for future, secret_id in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                # Left uncached; the caller's own lookup will raise with full context
+                logger.warning(f"Failed to prefetch secret {secret_id}: {e}")
+
+
+def invalidate_secret(secret_id, project=None):
+    with _lock:
+        _cache.pop((project or project_id, secret_id), None)
+
+
+def snapshot_stats():
+    """Copy of the counters, taken at the start of a handler so log_stats can report just that invocation."""
+    with _lock:
+        return dict(stats)
+
+
+def log_stats(since=None):
+    """Log cache hits, fetches and fetch latency since the `since` snapshot (or since process start)."""
+    current = snapshot_stats()
+    if since:
+        current = {key: value - since[key] for key, value in current.items()}
+    fetches = current["misses"]
+    avg_ms = (current["fetch_seconds"] / fetches * 1000) if fetches else 0.0
+    logger.info(f"Secret cache: {current['hits']} hits, {fetches} fetches, {avg_ms:.1f} ms average fetch latency")
+    return current
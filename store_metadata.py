@@ -1,15 +1,17 @@
 import os
 import sys
 import json
+import time
 import yaml
-import boto3
-import requests
+import threading
 import traceback
 from loguru import logger
 from datetime import datetime, timedelta
-from google.cloud import compute_v1
-from google.cloud import secretmanager
+from secret_provider import get_secret_gcp, get_client, prefetch_secrets, invalidate_secret, log_stats as log_secret_stats
+from metadata_writer import get_dynamodb_client
+from gcp_clients import images_client, instances_client, zone_operations_client, log_stats as log_client_stats
 from image_deprecation import deprecate_gcp_image
+from vm_cleanup import SCAN_VM_LABEL
 from email_notification import send_email_notification
  
 project_id = os.getenv('PROJECT_ID') 
@@ -26,12 +28,11 @@ prisma_username = os.getenv('prisma_username')
 prisma_password  = os.getenv('prisma_password')
 TOPIC_NAME = os.getenv('TOPIC_NAME')
 namespace = os.getenv('namespace')
-
-def get_secret_gcp(secret_id):
-    client = secretmanager.SecretManagerServiceClient()
-    name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
-    response = client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
+# The scan VM boots in the background; the step waits at most this long for it to reach RUNNING.
+# The watcher stops when the step exits, so a VM still booting is settled by the next run instead.
+scan_vm_wait_seconds = int(os.getenv('SCAN_VM_WAIT_SECONDS', '0'))
+scan_vm_ready_timeout = int(os.getenv('SCAN_VM_READY_TIMEOUT', '900'))  # Background watcher gives up after this
+scan_vm_poll_seconds = int(os.getenv('SCAN_VM_POLL_SECONDS', '10'))
 
 def get_instance_type(os_version):
     if os_version in ['Windows_2022']:
@@ -40,6 +41,7 @@ def get_instance_type(os_version):
         return 'e2-small'
 
 def get_token(username, secret, auth_endpoint):
+    import requests
     logger.info("fetching the prisma token")
     try:
         payload = json.dumps({ "password": secret, "username": username })
@@ -53,7 +55,7 @@ def get_token(username, secret, auth_endpoint):
 
 def create_secret(secret_id, secret_value):
     try:
-        client = secretmanager.SecretManagerServiceClient()
+        client = get_client()
         parent = f"projects/{project_id}"
         name = client.secret_path(project_id, secret_id)
         try:
@@ -68,6 +70,7 @@ def create_secret(secret_id, secret_value):
         payload = secret_value.encode("UTF-8")
         parent = client.secret_path(project_id, secret_id)
         response = client.add_secret_version( request={"parent": parent, "payload": {"data": payload}})
+        invalidate_secret(secret_id)
     except Exception as e:
         print(f"Error creating secret: {e}")
         return False
@@ -86,6 +89,7 @@ def generate_user_data_script(image, prisma_base_url, path_to_console, token):
         return script
 
 def buildGCPImages(image,prisma_username,prisma_password):
+    """Submit the scan VM insert and return {"instance", "zone", "operation"} without waiting for it, or False."""
     print("image.os_version", image['os_version'])
     instance_name = image['image_name']['S'] 
     instance_type = get_instance_type(image['os_version'])
@@ -134,9 +138,12 @@ def buildGCPImages(image,prisma_username,prisma_password):
 
         labels = {  
              #"os_version" : image["os_version"], ## to add anything in labels
+             # Scopes the all-zones VM cleanup to scan VMs
+             SCAN_VM_LABEL[0]: SCAN_VM_LABEL[1],
             }
         
-        instance_client = compute_v1.InstancesClient()
+        from google.cloud import compute_v1
+        instance_client = instances_client()
         disk = compute_v1.AttachedDisk()
         initialize_params = compute_v1.AttachedDiskInitializeParams()
         initialize_params.source_image = f"projects/{project_id}/global/images/family/{image_family}"
@@ -166,29 +173,132 @@ def buildGCPImages(image,prisma_username,prisma_password):
         instance.service_accounts = serviceAccounts
         instance.metadata = compute_v1.Metadata(items=metadata)
         
-        # Create the instance
+        # Create the instance; readiness is tracked by watch_scan_vm instead of blocking here
         operation = instance_client.insert(project=project_id, zone=zone, instance_resource=instance)
-        operation.result()  # Wait for the operation to complete
-        print("operation.result",operation.result())
-        print(f"Instance {instance_name} created successfully.")
+        print(f"Instance {instance_name} creation submitted, operation {operation.name}.")
     except Exception as e:
         print(f"Instance {instance_name} creation failed. {str(e)}")
         logger.error({'error': str(e), 'traceback': traceback.format_exc()})
         return False
-    return True
+    return {"instance": instance_name, "zone": zone, "operation": operation}
+
+def record_scan_vm_status(client, image_name, status, scan_vm=None):
+    """Store the scan VM status on the image's item; with `scan_vm`, also where to check on it later."""
+    update = 'SET scan_vm_status = :status'
+    values = {':status': {'S': status}}
+    if scan_vm:
+        update += ', scan_vm_instance = :instance, scan_vm_zone = :zone, scan_vm_operation = :operation, scan_vm_started_at = :started'
+        values.update({':instance': {'S': scan_vm['instance']}, ':zone': {'S': scan_vm['zone']}
+        , ':operation': {'S': scan_vm['operation'].name}, ':started': {'N': str(round(time.time()))}})
+    try:
+        client.update_item(TableName=image_table, Key={'csp': {'S': 'gcp'}, 'image_name': {'S': image_name}}
+        , UpdateExpression=update, ExpressionAttributeValues=values)
+    except Exception as e:
+        logger.error(f"Failed to record scan VM status {status} for {image_name}: {e}")
+
+def check_scan_vm(item):
+    """One look at a PROVISIONING scan VM: its final status, or None while it is still starting."""
+    from google.api_core.exceptions import NotFound
+    instance, zone = item['scan_vm_instance']['S'], item['scan_vm_zone']['S']
+    try:
+        if instances_client().get(project=project_id, zone=zone, instance=instance).status == "RUNNING":
+            return "RUNNING"
+    except NotFound:
+        operation = zone_operations_client().get(project=project_id, zone=zone, operation=item['scan_vm_operation']['S'])
+        if operation.error and operation.error.errors:
+            logger.error(f"Scan VM {instance} failed to start: {operation.error}")
+            return "FAILED"
+    if time.time() - int(item['scan_vm_started_at']['N']) > scan_vm_ready_timeout:
+        return "TIMEOUT"
+    return None
+
+def resolve_pending_scan_vms(client):
+    """Settle the scan VMs earlier runs left as PROVISIONING, since their watcher ended with the process."""
+    request = {'TableName': image_table, 'KeyConditionExpression': 'csp = :csp'
+    , 'FilterExpression': 'scan_vm_status = :status AND attribute_exists(scan_vm_instance)'
+    , 'ExpressionAttributeValues': {':csp': {'S': 'gcp'}, ':status': {'S': 'PROVISIONING'}}}
+    resolved = 0
+    while True:
+        response = client.query(**request)
+        for item in response.get('Items', []):
+            try:
+                status = check_scan_vm(item)
+            except Exception as e:
+                logger.error(f"Failed to check scan VM for {item['image_name']['S']}: {e}")
+                continue
+            if status:
+                logger.info(f"Scan VM {item['scan_vm_instance']['S']} status: {status}")
+                record_scan_vm_status(client, item['image_name']['S'], status)
+                resolved += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return resolved
+
+def watch_scan_vm(scan_vm, timeout=scan_vm_ready_timeout, poll_seconds=scan_vm_poll_seconds):
+    """Poll the insert operation, then the instance, until the scan VM is RUNNING. Returns the final status."""
+    deadline = time.monotonic() + timeout
+    operation = scan_vm["operation"]
+    while not operation.done():
+        if time.monotonic() > deadline:
+            return "TIMEOUT"
+        time.sleep(poll_seconds)
+    if operation.error_code:
+        logger.error(f"Scan VM {scan_vm['instance']} failed to start: {operation.error_message}")
+        return "FAILED"
+    while True:
+        status = instances_client().get(project=project_id, zone=scan_vm["zone"], instance=scan_vm["instance"]).status
+        if status == "RUNNING" or time.monotonic() > deadline:
+            return status if status == "RUNNING" else "TIMEOUT"
+        time.sleep(poll_seconds)
+
+def start_scan_vm(client, item):
+    """Launch and watch the scan VM on a background thread.
+
+    Returns (launched, ready) events: `launched` is set once the insert has been submitted (or failed),
+    `ready` once the watcher has recorded the VM's final status in the metadata table.
+    """
+    launched, ready = threading.Event(), threading.Event()
+
+    def run():
+        try:
+            scan_vm = buildGCPImages(item, prisma_username, prisma_password)
+            logger.info(f"Build Status: {bool(scan_vm)}")
+            if not scan_vm:
+                record_scan_vm_status(client, item['image_name']['S'], 'FAILED')
+                return
+            record_scan_vm_status(client, item['image_name']['S'], 'PROVISIONING', scan_vm)
+            launched.set()
+            status = watch_scan_vm(scan_vm)
+            logger.info(f"Scan VM {scan_vm['instance']} status: {status}")
+            record_scan_vm_status(client, item['image_name']['S'], status)
+        except Exception as e:
+            logger.error({'error': str(e), 'traceback': traceback.format_exc()})
+        finally:
+            launched.set()
+            ready.set()
+
+    # Daemon thread: the step may exit while the VM is still booting, the insert has already been accepted.
+    # A VM left PROVISIONING that way is settled by resolve_pending_scan_vms on a later run.
+    threading.Thread(target=run, name="scan-vm", daemon=True).start()
+    return launched, ready
 
 @logger.catch
 def main():
     try:
         print("Inside main")
-        aws_access_key = get_secret_gcp(os.getenv('aws_access_key',"aws-access-key"))
-        aws_secret_key = get_secret_gcp(os.getenv('aws_secret_key',"aws-secret-key"))
-        client = boto3.client('dynamodb', region_name='us-east-1'
-        , aws_access_key_id=aws_access_key, aws_secret_access_key=aws_secret_key)
+        prefetch_secrets([os.getenv('aws_access_key',"aws-access-key"), os.getenv('aws_secret_key',"aws-secret-key")
+        , prisma_username, prisma_password])
+        client = get_dynamodb_client()
+        try:
+            logger.info(f"Resolved {resolve_pending_scan_vms(client)} scan VMs left provisioning by earlier runs")
+        except Exception as e:
+            logger.error(f"Failed to resolve pending scan VMs: {e}")
         image_metadata = yaml.load(open('image_metadata.yml'), Loader=yaml.FullLoader)['image_metadata']
         create_time = datetime.strptime(image_metadata['date_created'], "%Y-%m-%d-%H%M%S")
         delete_time = create_time + timedelta(days=365)
-        gcp_client = compute_v1.ImagesClient()
+        from google.cloud import compute_v1
+        gcp_client = images_client()
         request = compute_v1.GetImageRequest(project=project_id, image=image_metadata['image_name'])
         response = gcp_client.get(request=request)
         source_image_response = gcp_client.get_from_family(project=source_image_project, family=source_image_family)
@@ -219,10 +329,18 @@ def main():
                 body = {'image_version': "Failed"}
                 send_email_notification(email_subject, body)
             
-            build_status = buildGCPImages(item,prisma_username,prisma_password)
-            logger.info(f"Build Status: {build_status}")
+            # Slow path on a background thread: token, secret and scan VM insert, then readiness tracking
+            launched, ready = start_scan_vm(client, item)
+            # Fast path: the metadata is written, so older images can be deprecated right away
             status, status_msg = deprecate_gcp_image(project_id, image_metadata['image_name'])
             logger.info(f"Deprecation Status Message: {status_msg}")
+            # Only wait until the insert is submitted; VM boot time is not on the build's critical path
+            launched.wait()
+            if not ready.wait(scan_vm_wait_seconds):
+                logger.info(f"Scan VM still provisioning after {scan_vm_wait_seconds}s, not waiting for it"
+                f" (scan_vm_status stays PROVISIONING until the next run or `store_metadata.py resolve-scan-vms`)")
+            log_secret_stats()
+            log_client_stats()
         else:
             logger.error('Failed to find AMI Ids for build!')
             sys.exit(1)
@@ -231,4 +349,7 @@ def main():
         sys.exit(1)
         
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:] == ['resolve-scan-vms']:
+        print("resolved", resolve_pending_scan_vms(get_dynamodb_client()))
+    else:
+        main()
@@ -0,0 +1,165 @@
+import pytest
+
+import build_scheduler
+from build_scheduler import BuildScheduler, FakeBuildBackend, MemoryStateStore, SchedulerBusy
+
+
+def make_scheduler(max_in_flight=2, ticks_to_finish=2, **kwargs):
+    backend = FakeBuildBackend(ticks_to_finish=ticks_to_finish)
+    return BuildScheduler(backend, MemoryStateStore(), max_in_flight=max_in_flight, **kwargs), backend
+
+
+def test_admits_builds_in_priority_order():
+    scheduler, backend = make_scheduler(max_in_flight=1, ticks_to_finish=1)
+    scheduler.enqueue([
+        ("gim-windows-2022", {}, 50, None),
+        ("gim-rhel-8", {}, None, None),
+        ("gim-rhel-9", {}, 10, None),
+    ])
+
+    for _ in range(4):
+        scheduler.tick()
+
+    # rhel-8 has no priority and falls back to the default (100), so it runs last
+    assert backend.submitted == ["gim-rhel-9", "gim-windows-2022", "gim-rhel-8"]
+
+
+def test_equal_priorities_run_in_enqueue_order():
+    scheduler, backend = make_scheduler(max_in_flight=1, ticks_to_finish=1)
+    scheduler.enqueue([("first", {}, 5, None)])
+    scheduler.enqueue([("second", {}, 5, None)])
+
+    scheduler.tick()
+
+    assert backend.submitted == ["first"]
+
+
+def test_never_exceeds_max_in_flight():
+    scheduler, backend = make_scheduler(max_in_flight=2, ticks_to_finish=3)
+    scheduler.enqueue([(f"image-{i}", {}, i, None) for i in range(5)])
+
+    while True:
+        summary = scheduler.tick()
+        assert summary["running"] <= 2
+        if summary["done"] == 5:
+            break
+
+    assert backend.submitted == [f"image-{i}" for i in range(5)]
+
+
+def test_frees_a_slot_when_a_build_finishes():
+    scheduler, backend = make_scheduler(max_in_flight=1, ticks_to_finish=100)
+    scheduler.enqueue([("a", {}, 1, None), ("b", {}, 2, None)])
+    summary = scheduler.tick()
+    assert summary["running"] == 1 and summary["queued"] == 1
+
+    backend.finish(summary["builds"]["a"]["build_id"])
+    summary = scheduler.tick()
+
+    assert summary["builds"]["a"]["status"] == "SUCCESS"
+    assert summary["builds"]["b"]["state"] == "running"
+
+
+def test_reports_finished_builds():
+    finished = []
+    scheduler, _ = make_scheduler(ticks_to_finish=1, on_finished=lambda name, entry: finished.append((name, entry["status"])))
+    scheduler.enqueue([("a", {}, 1, None)])
+
+    scheduler.tick()
+    scheduler.tick()
+
+    assert finished == [("a", "SUCCESS")]
+
+
+def test_submit_failure_does_not_hold_a_slot():
+    scheduler, backend = make_scheduler(max_in_flight=1)
+
+    def submit(name, image):
+        if name == "broken":
+            raise RuntimeError("quota exceeded")
+        return FakeBuildBackend.submit(backend, name, image)
+
+    backend.submit = submit
+    scheduler.enqueue([("broken", {}, 1, None), ("ok", {}, 2, None)])
+
+    summary = scheduler.tick()
+    assert summary["builds"]["broken"]["status"] == "SUBMIT_FAILED"
+    assert summary["builds"]["ok"]["state"] == "queued"
+
+    summary = scheduler.tick()
+    assert summary["builds"]["ok"]["state"] == "running"
+
+
+def test_requeue_leaves_queued_and_running_builds_alone():
+    scheduler, backend = make_scheduler(max_in_flight=1, ticks_to_finish=100)
+    scheduler.enqueue([("a", {}, 1, None), ("b", {}, 2, None)])
+    scheduler.tick()
+
+    assert scheduler.enqueue([("a", {}, 1, None), ("b", {}, 2, None)]) == 0
+    assert backend.submitted == ["a"]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(build_scheduler.time, "sleep", delays.append)
+    return delays
+
+
+def test_second_invocation_is_refused_while_the_lease_is_held(sleeps):
+    store = MemoryStateStore()
+    first = BuildScheduler(FakeBuildBackend(), store)
+    second = BuildScheduler(FakeBuildBackend(), store)
+    state, token = first._acquire()
+
+    with pytest.raises(SchedulerBusy):
+        second.tick()
+    assert sleeps == [1, 2, 4, 8]
+
+    first._release(state, token)
+    second.tick()
+
+
+def test_enqueue_waits_for_a_tick_holding_the_lease(monkeypatch):
+    store = MemoryStateStore()
+    ticker = BuildScheduler(FakeBuildBackend(), store)
+    trigger = BuildScheduler(FakeBuildBackend(), store)
+    held = ticker._acquire()
+
+    # The tick finishes while the trigger is backing off
+    monkeypatch.setattr(build_scheduler.time, "sleep", lambda seconds: ticker._release(*held))
+
+    assert trigger.enqueue([("a", {}, 1, None)]) == 1
+
+
+def test_failing_on_finished_does_not_block_the_queue():
+    def on_finished(name, entry):
+        raise RuntimeError("DynamoDB unavailable")
+
+    scheduler, backend = make_scheduler(max_in_flight=1, ticks_to_finish=1, on_finished=on_finished)
+    scheduler.enqueue([("a", {}, 1, None), ("b", {}, 2, None)])
+    scheduler.tick()
+
+    summary = scheduler.tick()
+
+    assert summary["builds"]["a"]["status"] == "SUCCESS"
+    assert summary["builds"]["b"]["state"] == "running"
+
+
+def test_lease_is_released_when_a_status_lookup_fails(sleeps):
+    scheduler, backend = make_scheduler(max_in_flight=1)
+    scheduler.enqueue([("a", {}, 1, None), ("b", {}, 2, None)])
+    scheduler.tick()
+
+    def unavailable(build_ids):
+        raise RuntimeError("Cloud Build unavailable")
+
+    backend.statuses = unavailable
+    with pytest.raises(RuntimeError):
+        scheduler.tick()
+
+    other = BuildScheduler(backend, scheduler.store, max_in_flight=1)
+    del backend.statuses
+    summary = other.tick()
+    assert summary["builds"]["a"]["state"] == "running"
+    assert sleeps == []
@@ -0,0 +1,67 @@
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import image_records
+from image_records import ImageTable, plan_table
+from lifecycle_engine import lifecycle_policy
+
+pytest.importorskip("numpy")
+
+NOW = datetime(2025, 6, 1, tzinfo=timezone.utc)
+POLICIES = [
+    lifecycle_policy(1, 2, 3),
+    lifecycle_policy(deprecate_days=7),
+    lifecycle_policy(obsolete_days=30),
+    lifecycle_policy(delete_days=3),
+    lifecycle_policy(10, None, 60),
+    lifecycle_policy(None, 20, 90),
+]
+
+
+def synthetic_images(count, seed=7):
+    rng = random.Random(seed)
+    images = []
+    for i in range(count):
+        created = NOW - timedelta(days=rng.uniform(0, 120), seconds=rng.randint(0, 86399))
+        state = rng.choice(["", "", "", "DEPRECATED", "OBSOLETE", "DELETED"])
+        images.append(SimpleNamespace(
+            name=f"image-{i}",
+            family=rng.choice(["gim-rhel-8", "gim-rhel-9", "gim-windows-2022", ""]),
+            status=rng.choice(["READY"] * 9 + ["PENDING"]),
+            creation_timestamp=created.isoformat(timespec="milliseconds"),
+            labels={"image_type": rng.choice(["golden-image", "base"])},
+            deprecated=SimpleNamespace(state=state) if state else None,
+        ))
+    return images
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+def test_numpy_plan_matches_the_loop_planner(policy, monkeypatch):
+    table = ImageTable.from_images(synthetic_images(5000))
+    keep = ["image-3", "image-42"]
+
+    vectorised = plan_table(table, policy, NOW, keep)
+    monkeypatch.setattr(image_records, "np", None)
+    looped = plan_table(table, policy, NOW, keep)
+
+    assert vectorised == looped
+    assert vectorised
+
+
+def test_newest_ready_image_of_a_family_is_kept(monkeypatch):
+    images = [
+        SimpleNamespace(name=name, family="gim-rhel-9", status="READY", labels={}, deprecated=None,
+                        creation_timestamp=(NOW - timedelta(days=age)).isoformat(timespec="milliseconds"))
+        for name, age in [("old", 40), ("newest", 30)]
+    ]
+    for np_module in (image_records.np, None):
+        monkeypatch.setattr(image_records, "np", np_module)
+        plan = plan_table(ImageTable.from_images(images), lifecycle_policy(deprecate_days=7), NOW)
+        assert plan == [{"image": "old", "family": "gim-rhel-9", "from": "READY", "to": "DEPRECATED"}]
+
+
+def test_empty_table_plans_nothing():
+    assert plan_table(ImageTable(), lifecycle_policy(1, 2, 3), NOW) == []
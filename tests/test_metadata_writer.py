@@ -0,0 +1,109 @@
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+from botocore.exceptions import ClientError
+
+import metadata_writer
+from metadata_writer import MetadataWriter
+
+TABLE = "golden-images-metadata"
+
+
+@pytest.fixture
+def db_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("dynamodb", region_name="us-east-1")
+        client.create_table(
+            TableName=TABLE,
+            KeySchema=[{"AttributeName": "csp", "KeyType": "HASH"}, {"AttributeName": "image_name", "KeyType": "RANGE"}],
+            AttributeDefinitions=[{"AttributeName": "csp", "AttributeType": "S"},
+                                  {"AttributeName": "image_name", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+
+
+def put_image(client, image_name, active):
+    client.put_item(TableName=TABLE, Item={"csp": {"S": "gcp"}, "image_name": {"S": image_name}, "active": {"S": active}})
+
+
+def active_flag(client, image_name):
+    item = client.get_item(TableName=TABLE, Key={"csp": {"S": "gcp"}, "image_name": {"S": image_name}}).get("Item")
+    return item["active"]["S"] if item else None
+
+
+def test_skips_inactive_and_missing_images_and_retries_the_rest(db_client):
+    put_image(db_client, "gim-rhel-9-a", "true")
+    put_image(db_client, "gim-rhel-9-b", "false")
+    put_image(db_client, "gim-rhel-9-c", "true")
+    writer = MetadataWriter(db_client, TABLE)
+    for image_name in ["gim-rhel-9-a", "gim-rhel-9-b", "gim-rhel-9-c", "gim-rhel-9-missing"]:
+        writer.deactivate(image_name)
+
+    stats = writer.flush()
+
+    # b is already inactive and missing does not exist: both cancel the first transaction, the retry writes a and c
+    assert stats == {"updated": 2, "skipped": 2, "failed": 0}
+    assert active_flag(db_client, "gim-rhel-9-a") == "false"
+    assert active_flag(db_client, "gim-rhel-9-c") == "false"
+    assert active_flag(db_client, "gim-rhel-9-missing") is None
+
+
+def test_repeat_run_writes_nothing(db_client):
+    put_image(db_client, "gim-rhel-9-a", "true")
+    writer = MetadataWriter(db_client, TABLE)
+    writer.deactivate("gim-rhel-9-a")
+    writer.flush()
+    writer.deactivate("gim-rhel-9-a")
+
+    assert writer.flush() == {"updated": 1, "skipped": 1, "failed": 0}
+
+
+def test_keeps_the_latest_status_per_image_within_a_batch(db_client):
+    put_image(db_client, "gim-rhel-9-a", "false")
+    writer = MetadataWriter(db_client, TABLE)
+    writer.deactivate("gim-rhel-9-a")
+    writer.set_active("gim-rhel-9-a", True)
+
+    # A transaction may touch an item only once, so the two transitions collapse into the last one
+    assert writer.flush() == {"updated": 1, "skipped": 0, "failed": 0}
+    assert active_flag(db_client, "gim-rhel-9-a") == "true"
+
+
+class ThrottledClient:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def transact_write_items(self, TransactItems):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ClientError({"Error": {"Code": "ProvisionedThroughputExceededException", "Message": "slow down"}},
+                              "TransactWriteItems")
+
+
+def test_backs_off_exponentially_on_other_errors(monkeypatch):
+    delays = []
+    monkeypatch.setattr(metadata_writer.time, "sleep", delays.append)
+    monkeypatch.setattr(metadata_writer, "retry_base_seconds", 0.5)
+    client = ThrottledClient(failures=2)
+    writer = MetadataWriter(client, TABLE)
+    writer.deactivate("gim-rhel-9-a")
+
+    assert writer.flush() == {"updated": 1, "skipped": 0, "failed": 0}
+    assert delays == [0.5, 1.0]
+
+
+def test_gives_up_after_max_attempts(monkeypatch):
+    delays = []
+    monkeypatch.setattr(metadata_writer.time, "sleep", delays.append)
+    client = ThrottledClient(failures=metadata_writer.MAX_ATTEMPTS)
+    writer = MetadataWriter(client, TABLE)
+    writer.deactivate("gim-rhel-9-a")
+
+    assert writer.flush() == {"updated": 0, "skipped": 0, "failed": 1}
+    assert client.calls == metadata_writer.MAX_ATTEMPTS
+    assert len(delays) == metadata_writer.MAX_ATTEMPTS - 1
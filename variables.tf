@@ -39,3 +39,8 @@ variable "namespace" {
 variable "environment" {
   type = string
 }
+
+variable "build_scheduler" {
+  type    = bool
+  default = false
+}
@@ -0,0 +1,139 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from gcp_clients import instances_client, zone_operations_client
+
+logger = logging.getLogger()
+
+operation_timeout = int(os.getenv('OPERATION_TIMEOUT_SECONDS', '900'))  # Give up waiting on deletes after this
+zone_workers = int(os.getenv('CLEANUP_ZONE_WORKERS', '8'))  # Zones deleted in parallel
+PROTECT_LABEL = "do-not-delete-vm"
+# Label store_metadata.py puts on the scan VMs it creates, and the default scope of the all-zones cleanup
+SCAN_VM_LABEL = ("purpose", "image-scan")
+SCAN_VM_LABEL_FILTER = f'labels.{SCAN_VM_LABEL[0]} = "{SCAN_VM_LABEL[1]}"'
+
+
+def stale_instance_filter(older_than_days, label_filter=None):
+    """Server-side filter for instances created before the cutoff, optionally narrowed by a label expression.
+
+    The API compares creationTimestamp as a string and the protect label may be missing, so callers still
+    check age and PROTECT_LABEL in memory; the filter only keeps fresh or out-of-scope VMs out of the listing.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime("%Y-%m-%dT%H:%M:%S")
+    parts = [f'(creationTimestamp < "{cutoff}")']
+    if label_filter:
+        parts.append(f"({label_filter})")
+    return " AND ".join(parts)
+
+
+def list_instances_all_zones(project_id, filter_str=None):
+    """Every instance of a project across all zones as (zone, instance) pairs, from one paged aggregated listing."""
+    from google.cloud import compute_v1
+    instance_client = instances_client()
+    request = compute_v1.AggregatedListInstancesRequest(project=project_id, filter=filter_str, max_results=500)
+    instances = []
+    for zone, scoped_list in instance_client.aggregated_list(request=request):
+        for instance in scoped_list.instances:
+            instances.append((zone.split('/')[-1], instance))
+    return instances
+
+
+def is_protected(instance):
+    return instance.labels.get(PROTECT_LABEL) == 'true'
+
+
+def is_older_than(instance, cutoff):
+    return datetime.strptime(instance.creation_timestamp, "%Y-%m-%dT%H:%M:%S.%f%z") < cutoff
+
+
+def wait_for_operations(project_id, operations, timeout=operation_timeout):
+    """Wait for many zone operations together and return {name: error message or None}.
+
+    `operations` is a list of (zone, name, operation); `name` only labels the result. Each round makes
+    one server-side `wait` and checks the other pending operations with a non-blocking `get`, so a round
+    costs at most one wait. The deadline is checked before every call; operations still running after
+    `timeout` seconds are reported as timed out.
+    """
+    from google.cloud import compute_v1
+    operation_client = zone_operations_client()
+    deadline = time.monotonic() + timeout
+    pending = list(operations)
+    results = {}
+    backoff = 1
+    while pending:
+        still_pending = []
+        waited = False
+        for zone, name, operation in pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                still_pending.append((zone, name, operation))
+                continue
+            try:
+                if waited:
+                    result = operation_client.get(project=project_id, zone=zone, operation=operation.name)
+                else:
+                    result = operation_client.wait(project=project_id, zone=zone, operation=operation.name
+                    , timeout=remaining)
+                    waited = True
+            except Exception as e:
+                if time.monotonic() >= deadline:
+                    still_pending.append((zone, name, operation))
+                    continue
+                logger.error(f"Failed to wait for delete of {name}: {e}")
+                results[name] = str(e)
+                continue
+            if result.status != compute_v1.Operation.Status.DONE:
+                still_pending.append((zone, name, operation))
+            elif result.error and result.error.errors:
+                logger.error(f"Error deleting {name}: {result.error}")
+                results[name] = str(result.error)
+            else:
+                logger.info(f"Deleted {name} in zone {zone}.")
+                results[name] = None
+        if still_pending and time.monotonic() >= deadline:
+            for zone, name, operation in still_pending:
+                logger.error(f"Timed out waiting for delete of {name} ({operation.name}).")
+                results[name] = "timed out"
+            break
+        if still_pending:
+            logger.info(f"Waiting for {len(still_pending)} delete operations to complete...")
+            if len(still_pending) == len(pending):
+                time.sleep(min(backoff, max(0, deadline - time.monotonic())))
+                backoff = min(backoff * 2, 30)
+        pending = still_pending
+    return results
+
+
+def delete_instances_by_zone(project_id, zone_instances, workers=zone_workers):
+    """Delete (zone, instance_name) pairs, running each zone's deletes and wait in parallel with the other zones.
+
+    Returns {"zone/instance_name": error message or None}.
+    """
+    by_zone = {}
+    for zone, instance_name in zone_instances:
+        by_zone.setdefault(zone, []).append(instance_name)
+    instance_client = instances_client()
+
+    def delete_zone(zone):
+        results = {}
+        operations = []
+        for instance_name in by_zone[zone]:
+            key = f"{zone}/{instance_name}"
+            try:
+                operations.append((zone, key, instance_client.delete(project=project_id, zone=zone, instance=instance_name)))
+                logger.info(f"Deleting instance {instance_name} in project {project_id}, zone {zone}...")
+            except Exception as e:
+                logger.error(f"Failed to submit delete for instance {instance_name}: {e}")
+                results[key] = str(e)
+        results.update(wait_for_operations(project_id, operations))
+        return results
+
+    results = {}
+    if not by_zone:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(by_zone)))) as executor:
+        for zone_results in executor.map(delete_zone, by_zone):
+            results.update(zone_results)
+    return results